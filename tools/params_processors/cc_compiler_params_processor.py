@@ -1,78 +1,24 @@
 #!/usr/bin/python3
 
 import sys
-from typing import Iterator, List, Optional
-
-
-# C and C++ compiler flags that we don't want to propagate to Xcode.
-# The values are the number of flags to skip, 1 being the flag itself, 2 being
-# another flag right after it, etc.
-_CC_SKIP_OPTS = {
-    # Xcode sets these, and no way to unset them
-    "-isysroot": 2,
-    "-mios-simulator-version-min": 1,
-    "-miphoneos-version-min": 1,
-    "-mmacosx-version-min": 1,
-    "-mtvos-simulator-version-min": 1,
-    "-mtvos-version-min": 1,
-    "-mwatchos-simulator-version-min": 1,
-    "-mwatchos-version-min": 1,
-    "-target": 2,
-
-    # Xcode sets input and output paths
-    "-c": 2,
-    "-o": 2,
-
-    # TODO: This comment should be updated to not reference opts.bzl
-    # Debug info is handled in `opts.bzl`
-    "-g": 1,
-
-    # We set this in the generator
-    "-fobjc-arc": 1,
-    "-fno-objc-arc": 1,
-
-    # We want to use Xcode's dependency file handling
-    "-MD": 1,
-    "-MF": 2,
-
-    # We want to use Xcode's normal indexing handling
-    "-index-ignore-system-symbols": 1,
-    "-index-store-path": 2,
-
-    # We want Xcode to control coloring
-    "-fcolor-diagnostics": 1,
-
-    # This is wrapped_clang specific, and we don't want to translate it for BwX
-    "DEBUG_PREFIX_MAP_PWD": 1,
-}
-
-_NEEDS_PROJECT_DIR = {
-    "-ivfsoverlay": None,
-    "--config": None,
-}
-
-
-def _inner_process_cc_opts(opt: str, previous_opt: Optional[str]) -> str:
-    # Short-circuit opts that are too short for our checks
-    if len(opt) < 2:
-        return opt
-
-    # -ivfsoverlay and --config doesn't apply `-working_directory=`, so we
-    # need to prefix it ourselves
-    if previous_opt in _NEEDS_PROJECT_DIR:
-        if opt[0] != "/":
-            return "$(PROJECT_DIR)/" + opt
-        return opt
-    if opt.startswith("-ivfsoverlay"):
-        value = opt[12:]
-        if not value.startswith("/"):
-            return "-ivfsoverlay" + "$(PROJECT_DIR)/" + value
-        return opt
-
-    return opt
+from typing import Iterator, List
+
+# Siblings, so this works both from Bazel and when run directly
+import flag_rules
+import params_worker
+
+
+# Cache subdirectory of this processor, see `params_worker.ParamsCache`
+_NAME = "cc_compiler_params_processor"
 
 
 def process_args(params_paths: List[str], parse_args) -> List[str]:
+    # Bound once, as these are called for every opt
+    rules = flag_rules.CC_RULES
+    skip_count = rules.skip_count
+    rewrite_project_dir = rules.rewrite_project_dir
+    finish = rules.finish
+
     # First line is "wrapped_clang"
     skip_next = 1
 
@@ -92,17 +38,12 @@ def process_args(params_paths: List[str], parse_args) -> List[str]:
             if opt.startswith("'") and opt.endswith("'"):
                 opt = opt[1:-1]
 
-            root_opt = opt.split("=")[0]
-
-            skip_next = _CC_SKIP_OPTS.get(root_opt, 0)
+            skip_next = skip_count(opt)
             if skip_next:
                 skip_next -= 1
                 continue
 
-            processed_opt = _inner_process_cc_opts(
-                opt,
-                previous_opt,
-            )
+            processed_opt = rewrite_project_dir(opt, previous_opt)
 
             previous_opt = opt
 
@@ -110,29 +51,32 @@ def process_args(params_paths: List[str], parse_args) -> List[str]:
             if not opt:
                 continue
 
-            # Use Xcode set `DEVELOPER_DIR`
-            opt = opt.replace("__BAZEL_XCODE_DEVELOPER_DIR__", "$(DEVELOPER_DIR)")
-
-            # Use Xcode set `SDKROOT`
-            opt = opt.replace("__BAZEL_XCODE_SDKROOT__", "$(SDKROOT)")
-
-            # Quote the option if it contains spaces, quotes, or build setting
-            # variables
-            if " " in opt or "\"" in opt or ("$(" in opt and ")" in opt):
-                opt = f"'{opt}'"
-
-            processed_opts.append(opt)
+            processed_opts.append(finish(opt))
 
     return processed_opts
 
 
 def _main(output_path: str, params_paths: List[str]) -> None:
+    cache = params_worker.ParamsCache.from_env(
+        name = _NAME,
+        sources = [__file__, flag_rules.__file__],
+    )
+    if cache:
+        key = cache.new_key()
+        for params_path in params_paths:
+            cache.update_key_with_file(key, params_path)
+        if cache.restore(key, output_path):
+            return
+
     processed_opts = process_args(params_paths, _parse_args)
 
     with open(output_path, encoding = "utf-8", mode = "w") as fp:
         result = "\n".join(processed_opts)
         fp.write(f'{result}\n')
 
+    if cache:
+        cache.store(key, output_path)
+
 
 def _parse_args(params_path: str) -> Iterator[str]:
     return open(params_path, encoding = "utf-8")
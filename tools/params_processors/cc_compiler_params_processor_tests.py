@@ -1,9 +1,15 @@
 """Tests for cc_compiler_params_processor."""
 
+import os
+import tempfile
 import unittest
+import unittest.mock
 
 from tools.params_processors import cc_compiler_params_processor
 
+# The module the processor imports, which holds the caches it uses
+params_worker = cc_compiler_params_processor.params_worker
+
 class cc_compiler_params_processor_test(unittest.TestCase):
 
     def test_skips(self):
@@ -68,5 +74,86 @@ class cc_compiler_params_processor_test(unittest.TestCase):
             ],
         )
 
+    def test_rewriting(self):
+        def _parse_args(args):
+            return [f"{arg}\n" for arg in args]
+
+        self.assertEqual(
+            cc_compiler_params_processor.process_args(
+                [[
+                    "clang",
+                    "'-DFOO=1'",
+                    "-c",
+                    "a.c",
+                    "-MF",
+                    "a.d",
+                    "-I__BAZEL_XCODE_DEVELOPER_DIR__/x",
+                    "-isystem__BAZEL_XCODE_SDKROOT__/usr/include",
+                    "__BAZEL_XCODE_SDKROOT____BAZEL_XCODE_DEVELOPER_DIR__",
+                    "-DA=$(B)",
+                    "-DA=$(B",
+                    "-DSPACE=a b",
+                    "-ivfsoverlayrel/o.yaml",
+                    "-ivfsoverlay/abs.yaml",
+                    "--config",
+                    "/abs/c.cfg",
+                    "DEBUG_PREFIX_MAP_PWD=.",
+                    "-",
+                ]],
+                _parse_args,
+            ),
+            [
+                "-DFOO=1",
+                "'-I$(DEVELOPER_DIR)/x'",
+                "'-isystem$(SDKROOT)/usr/include'",
+                "'$(SDKROOT)$(DEVELOPER_DIR)'",
+                "'-DA=$(B)'",
+                "-DA=$(B",
+                "'-DSPACE=a b'",
+                "'-ivfsoverlay$(PROJECT_DIR)/rel/o.yaml'",
+                "-ivfsoverlay/abs.yaml",
+                "--config",
+                "/abs/c.cfg",
+                "-",
+            ],
+        )
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = os.path.join(tmp, "cache")
+            params = os.path.join(tmp, "compile.params")
+            with open(params, "w", encoding = "utf-8") as f:
+                f.write("clang\n-DFOO=1\n")
+
+            def _process(output_name):
+                output = os.path.join(tmp, output_name)
+                cc_compiler_params_processor._main(output, [params])
+                with open(output, encoding = "utf-8") as f:
+                    return f.read()
+
+            with unittest.mock.patch.dict(params_worker._CACHES), \
+                    unittest.mock.patch.dict(
+                        os.environ,
+                        {"RULES_XCODEPROJ_PARAMS_CACHE_DIR": cache_dir},
+                    ):
+                self.assertEqual(_process("a.params"), "-DFOO=1\n")
+                with unittest.mock.patch.object(
+                    cc_compiler_params_processor,
+                    "process_args",
+                    side_effect = AssertionError("cache miss"),
+                ):
+                    self.assertEqual(_process("b.params"), "-DFOO=1\n")
+
+                with open(params, "w", encoding = "utf-8") as f:
+                    f.write("clang\n-DFOO=2\n")
+                self.assertEqual(_process("c.params"), "-DFOO=2\n")
+
+                params_worker.write_stats()
+
+            self.assertEqual(
+                params_worker.read_stats(cache_dir),
+                {"hits": 1, "misses": 2, "evictions": 0},
+            )
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,259 @@
+"""Flag rewriting rules shared by the params processors."""
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Kinds of `_LD_DROP_RULES`
+_PREFIX = "prefix"
+_SUFFIX = "suffix"
+
+# Placeholders Bazel uses in flags, and the Xcode build settings that replace
+# them
+_PLACEHOLDERS = {
+    # Use Xcode set `DEVELOPER_DIR`
+    "__BAZEL_XCODE_DEVELOPER_DIR__": "$(DEVELOPER_DIR)",
+
+    # Use Xcode set `SDKROOT`
+    "__BAZEL_XCODE_SDKROOT__": "$(SDKROOT)",
+}
+
+# C and C++ compiler flags that we don't want to propagate to Xcode.
+# The values are the number of flags to skip, 1 being the flag itself, 2 being
+# another flag right after it, etc.
+_CC_SKIP_OPTS = {
+    # Xcode sets these, and no way to unset them
+    "-isysroot": 2,
+    "-mios-simulator-version-min": 1,
+    "-miphoneos-version-min": 1,
+    "-mmacosx-version-min": 1,
+    "-mtvos-simulator-version-min": 1,
+    "-mtvos-version-min": 1,
+    "-mwatchos-simulator-version-min": 1,
+    "-mwatchos-version-min": 1,
+    "-target": 2,
+
+    # Xcode sets input and output paths
+    "-c": 2,
+    "-o": 2,
+
+    # TODO: This comment should be updated to not reference opts.bzl
+    # Debug info is handled in `opts.bzl`
+    "-g": 1,
+
+    # We set this in the generator
+    "-fobjc-arc": 1,
+    "-fno-objc-arc": 1,
+
+    # We want to use Xcode's dependency file handling
+    "-MD": 1,
+    "-MF": 2,
+
+    # We want to use Xcode's normal indexing handling
+    "-index-ignore-system-symbols": 1,
+    "-index-store-path": 2,
+
+    # We want Xcode to control coloring
+    "-fcolor-diagnostics": 1,
+
+    # This is wrapped_clang specific, and we don't want to translate it for BwX
+    "DEBUG_PREFIX_MAP_PWD": 1,
+}
+
+# -ivfsoverlay and --config don't apply `-working_directory=`, so we need to
+# prefix relative paths passed to them with `$(PROJECT_DIR)` ourselves. These
+# are the flags whose next argument is such a path, and the flags that can
+# have the path joined to them.
+_CC_PROJECT_DIR_OPTS = {
+    "-ivfsoverlay": None,
+    "--config": None,
+}
+_CC_PROJECT_DIR_PREFIXES = ("-ivfsoverlay",)
+
+# linker flags that we don't want to propagate to Xcode.
+# The values are the number of flags to skip, 1 being the flag itself, 2 being
+# another flag right after it, etc.
+_LD_SKIP_OPTS = {
+    # Xcode sets the output path
+    "-o": 2,
+
+    # Xcode sets these, and no way to unset it
+    "-bundle": 2,
+    "-dynamiclib": 1,
+    "-e": 2,
+    "-isysroot": 2,
+    "-static": 1,
+    "-target": 2,
+
+    # Xcode sets this, even if `CLANG_LINK_OBJC_RUNTIME = NO` is set
+    "-fobjc-link-runtime": 1,
+
+    # This is wrapped_clang specific, and we don't want to translate it for BwX
+    "-Wl,-oso_prefix,__BAZEL_EXECUTION_ROOT__/": 1,
+    "OSO_PREFIX_MAP_PWD": 1,
+}
+
+# Linker flags that are removed, checked in order. Each rule is a kind
+# (`_PREFIX` or `_SUFFIX`), the string the flag starts or ends with, and
+# whether a `-force_load` right before the flag is removed as well.
+_LD_DROP_RULES = [
+    # Xcode sets entitlements
+    (_PREFIX, "-Wl,-sectcreate,__TEXT,__entitlements,", False),
+
+    # Xcode sets Info.plist
+    (_PREFIX, "-Wl,-sectcreate,__TEXT,__info_plist,", False),
+
+    # Xcode adds object files
+    (_SUFFIX, ".o", False),
+
+    # We don't want the BwB swizzle fix for BwX mode
+    (_SUFFIX, "/libswizzle_absolute_xcttestsourcelocation.a", True),
+
+    # These flags are for wrapped_clang only
+    (_PREFIX, "DSYM_HINT_DSYM_PATH=", False),
+    (_PREFIX, "DSYM_HINT_LINKED_BINARY=", False),
+]
+
+
+class FlagRules:
+    """A set of flag rewriting rules, compiled for fast per-flag dispatch.
+
+    Processors call `skip_count`, `drop`, `rewrite_project_dir`, and `finish`
+    on each flag, in that order, and keep the flag-specific state (e.g. how
+    many flags to skip next) themselves.
+    """
+
+    def __init__(
+            self,
+            *,
+            skip_opts: Dict[str, int],
+            skip_by_name: bool,
+            quote_substrings: Tuple[str, ...],
+            drop_rules: Iterable[Tuple[str, str, bool]] = (),
+            project_dir_opts: Optional[Dict[str, None]] = None,
+            project_dir_prefixes: Tuple[str, ...] = (),
+            placeholders: Dict[str, str] = _PLACEHOLDERS
+        ) -> None:
+        """Compiles rules.
+
+        Args:
+            skip_opts: Flags to remove, mapped to the number of flags to
+                remove, including the flag itself.
+            skip_by_name: Whether `skip_opts` is matched against the part of a
+                flag before any "=", instead of the whole flag.
+            quote_substrings: Flags containing any of these are quoted. Flags
+                containing both "$(" and ")" are always quoted.
+            drop_rules: Ordered `(kind, value, drops_force_load)` rules of
+                flags to remove, see `_LD_DROP_RULES`.
+            project_dir_opts: Flags whose next flag is made relative to
+                `$(PROJECT_DIR)`.
+            project_dir_prefixes: Flags that are made relative to
+                `$(PROJECT_DIR)` when followed by a path.
+            placeholders: Substrings to replace in kept flags.
+        """
+        self._skip_opts = skip_opts
+        self._skip_by_name = skip_by_name
+        self._quote_substrings = quote_substrings
+        self._project_dir_opts = project_dir_opts or {}
+        self._project_dir_prefixes = project_dir_prefixes
+        self._placeholders = list(placeholders.items())
+
+        # Only flags containing this are checked for `placeholders`
+        self._placeholder_prefix = os.path.commonprefix(list(placeholders))
+
+        # Consecutive drop rules with the same `-force_load` effect are
+        # checked with a single `str.startswith` and `str.endswith` call
+        groups: List[Tuple[List[str], List[str], bool]] = []
+        for kind, value, drops_force_load in drop_rules:
+            if not groups or groups[-1][2] != drops_force_load:
+                groups.append(([], [], drops_force_load))
+            groups[-1][0 if kind == _PREFIX else 1].append(value)
+        self._drop_groups = [
+            (tuple(prefixes), tuple(suffixes), drops_force_load)
+            for prefixes, suffixes, drops_force_load in groups
+        ]
+
+        # Most flags match none of the drop rules, which these rule out at
+        # once
+        self._drop_prefixes = tuple(
+            prefix for prefixes, _, _ in self._drop_groups for prefix in prefixes
+        )
+        self._drop_suffixes = tuple(
+            suffix for _, suffixes, _ in self._drop_groups for suffix in suffixes
+        )
+
+    def skip_count(self, opt: str) -> int:
+        """Returns the number of flags to remove, starting with `opt`."""
+        if self._skip_by_name:
+            opt = opt.partition("=")[0]
+        return self._skip_opts.get(opt, 0)
+
+    def drop(self, opt: str) -> Optional[bool]:
+        """Returns whether a drop rule matches `opt`.
+
+        Returns `None` if `opt` is kept. Otherwise returns whether a
+        `-force_load` right before `opt` should be removed as well.
+        """
+        if not (opt.startswith(self._drop_prefixes) or
+                opt.endswith(self._drop_suffixes)):
+            return None
+        for prefixes, suffixes, drops_force_load in self._drop_groups:
+            if opt.startswith(prefixes) or opt.endswith(suffixes):
+                return drops_force_load
+        return None
+
+    def rewrite_project_dir(self, opt: str, previous_opt: Optional[str]) -> str:
+        """Makes relative paths in `opt` relative to `$(PROJECT_DIR)`."""
+        # Short-circuit opts that are too short for our checks
+        if len(opt) < 2:
+            return opt
+
+        if previous_opt in self._project_dir_opts:
+            if opt[0] != "/":
+                return "$(PROJECT_DIR)/" + opt
+            return opt
+        if not opt.startswith(self._project_dir_prefixes):
+            return opt
+        for prefix in self._project_dir_prefixes:
+            if opt.startswith(prefix):
+                value = opt[len(prefix):]
+                if not value.startswith("/"):
+                    return prefix + "$(PROJECT_DIR)/" + value
+                return opt
+
+        return opt
+
+    def _substitute_placeholders(self, opt: str) -> str:
+        if self._placeholder_prefix in opt:
+            for placeholder, build_setting in self._placeholders:
+                opt = opt.replace(placeholder, build_setting)
+        return opt
+
+    def quote(self, opt: str) -> str:
+        """Quotes `opt` if it contains spaces or build setting variables."""
+        for substring in self._quote_substrings:
+            if substring in opt:
+                return f"'{opt}'"
+        if "$(" in opt and ")" in opt:
+            return f"'{opt}'"
+        return opt
+
+    def finish(self, opt: str) -> str:
+        """Substitutes placeholders in, and quotes, a kept flag."""
+        return self.quote(self._substitute_placeholders(opt))
+
+
+CC_RULES = FlagRules(
+    skip_opts = _CC_SKIP_OPTS,
+    skip_by_name = True,
+    quote_substrings = (" ", "\""),
+    project_dir_opts = _CC_PROJECT_DIR_OPTS,
+    project_dir_prefixes = _CC_PROJECT_DIR_PREFIXES,
+)
+
+LD_RULES = FlagRules(
+    skip_opts = _LD_SKIP_OPTS,
+    skip_by_name = False,
+    quote_substrings = (" ",),
+    drop_rules = _LD_DROP_RULES,
+)
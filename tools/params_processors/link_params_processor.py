@@ -2,125 +2,111 @@
 
 import json
 import sys
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
+# Siblings, so this works both from Bazel and when run directly
+import flag_rules
+import params_worker
 
-# linker flags that we don't want to propagate to Xcode.
-# The values are the number of flags to skip, 1 being the flag itself, 2 being
-# another flag right after it, etc.
-_LD_SKIP_OPTS = {
-    # Xcode sets the output path
-    "-o": 2,
 
-    # Xcode sets these, and no way to unset it
-    "-bundle": 2,
-    "-dynamiclib": 1,
-    "-e": 2,
-    "-isysroot": 2,
-    "-static": 1,
-    "-target": 2,
+# Cache subdirectory of this processor, see `params_worker.ParamsCache`
+_NAME = "link_params_processor"
 
-    # Xcode sets this, even if `CLANG_LINK_OBJC_RUNTIME = NO` is set
-    "-fobjc-link-runtime": 1,
 
-    # This is wrapped_clang specific, and we don't want to translate it for BwX
-    "-Wl,-oso_prefix,__BAZEL_EXECUTION_ROOT__/": 1,
-    "OSO_PREFIX_MAP_PWD": 1,
-}
+def _iter_lines(fp: Iterable[str]) -> Iterator[str]:
+    """Yields the lines of `fp` without their line endings."""
+    for line in fp:
+        yield line.rstrip("\r\n")
 
 
-def _parse_args(args_files: List[str]) -> List[str]:
-    args = []
+def _parse_args(args_files: List[str]) -> Iterator[str]:
     for args_path in args_files:
         # Each argument is a path to a file containing the actual arguments
         with open(args_path, encoding = "utf-8") as fp:
-            lines = fp.read().splitlines()
-            if lines[0].startswith("@"):
+            lines = _iter_lines(fp)
+            first_line = next(lines, None)
+            if first_line is None:
+                continue
+            if first_line.startswith("@"):
                 # Sometimes those arguments might be also be a redirect
-                with open(lines[0][1:], encoding = "utf-8") as f:
-                    args.extend(f.read().splitlines())
+                with open(first_line[1:], encoding = "utf-8") as f:
+                    yield from _iter_lines(f)
             else:
                 # First argument is the tool name
-                args.extend(lines[1:])
+                yield from lines
 
-    return args
 
-def _quote_if_needed(opt: str) -> str:
-    if " " in opt or ("$(" in opt and ")" in opt):
-        return f"'{opt}'"
-    return opt
+class _GeneratedProductPaths:
+    """Generated product paths, indexed for exact and suffix matching."""
 
+    def __init__(self, paths: Iterable[str]) -> None:
+        self._paths = set(paths)
 
-def _process_linkopts(
-        linkopts: List[str],
-        is_framework: bool,
-        generated_product_paths: List[str]
-    ) -> List[str]:
-    def _process_filelist(filelist_path: str) -> List[str]:
-        with open(filelist_path, encoding = "utf-8") as fp:
-            paths = fp.read().splitlines()
-
-        return [
-            _quote_if_needed(path)
-            for path in paths
-            if not path in generated_product_paths and not path.endswith(".o")
-        ]
-
-    processed_linkopts = []
-    def _quote_and_append_processed_linkopt(opt):
-        processed_linkopts.append(_quote_if_needed(opt))
-
-    last_opt = None
-    def _process_linkopt(opt):
-        if opt == "-filelist":
-            return
-        if last_opt == "-filelist":
-            # Not calling `_quote_and_append_processed_linkopt`, because
-            # `_process_filelist` applies quoting if needed
-            processed_linkopts.extend(_process_filelist(opt))
-            return
-
-        opt_generated_path_matches = [
-            path
-            for path in generated_product_paths
-            if opt.endswith(path)
-        ]
-        if opt_generated_path_matches:
-            if last_opt == "-force_load":
-                processed_linkopts.pop()
-            return
+        # An option that ends with a path containing a "/" has the same last
+        # path component as it, so those paths are indexed by it. Other paths
+        # can end in the middle of an option's last path component, so they
+        # are checked one by one.
+        self._by_basename: Dict[str, List[str]] = {}
+        self._without_directory = []
+        for path in self._paths:
+            _, separator, basename = path.rpartition("/")
+            if separator:
+                self._by_basename.setdefault(basename, []).append(path)
+            else:
+                self._without_directory.append(path)
 
-        # Xcode sets entitlements
-        if opt.startswith("-Wl,-sectcreate,__TEXT,__entitlements,"):
-            return
+    def __contains__(self, path: str) -> bool:
+        return path in self._paths
 
-        # Xcode sets Info.plist
-        if opt.startswith("-Wl,-sectcreate,__TEXT,__info_plist,"):
-            return
+    def is_suffix_of(self, opt: str) -> bool:
+        """Returns whether `opt` ends with any of the paths."""
+        candidates = self._by_basename.get(opt[opt.rfind("/") + 1:])
+        if candidates:
+            for path in candidates:
+                if opt.endswith(path):
+                    return True
+        for path in self._without_directory:
+            if opt.endswith(path):
+                return True
+        return False
 
-        # Xcode adds object files
-        if opt.endswith(".o"):
-            return
 
-        # We don't want the BwB swizzle fix for BwX mode
-        if opt.endswith("/libswizzle_absolute_xcttestsourcelocation.a"):
-            if last_opt == "-force_load":
-                processed_linkopts.pop()
-            return
-
-        # These flags are for wrapped_clang only
-        if (opt.startswith("DSYM_HINT_DSYM_PATH=") or
-            opt.startswith("DSYM_HINT_LINKED_BINARY=")):
+def _process_linkopts(
+        linkopts: Iterable[str],
+        is_framework: bool,
+        generated_product_paths: List[str]
+    ) -> Iterator[str]:
+    # Bound once, as these are called for every linkopt
+    rules = flag_rules.LD_RULES
+    skip_count = rules.skip_count
+    drop = rules.drop
+    finish = rules.finish
+    generated_product_paths = _GeneratedProductPaths(generated_product_paths)
+
+    # Filelists referenced more than once are only read and filtered once
+    processed_filelists: Dict[str, List[str]] = {}
+
+    def _process_filelist(filelist_path: str) -> Iterator[str]:
+        processed_filelist = processed_filelists.get(filelist_path)
+        if processed_filelist is not None:
+            yield from processed_filelist
             return
 
-        # Use Xcode set `DEVELOPER_DIR`
-        opt = opt.replace("__BAZEL_XCODE_DEVELOPER_DIR__", "$(DEVELOPER_DIR)")
-
-        # Use Xcode set `SDKROOT`
-        opt = opt.replace("__BAZEL_XCODE_SDKROOT__", "$(SDKROOT)")
-
-        _quote_and_append_processed_linkopt(opt)
+        processed_filelist = []
+        with open(filelist_path, encoding = "utf-8") as fp:
+            for path in _iter_lines(fp):
+                if path in generated_product_paths or path.endswith(".o"):
+                    continue
+                path = rules.quote(path)
+                processed_filelist.append(path)
+                yield path
+        processed_filelists[filelist_path] = processed_filelist
+
+    # The most recently processed linkopt is held back, since a later
+    # linkopt can remove it (e.g. a `-force_load` for a removed library)
+    pending_linkopt: Optional[str] = None
 
+    last_opt = None
     skip_next = 0
     for linkopt in linkopts:
         if skip_next:
@@ -132,15 +118,66 @@ def _process_linkopts(
         if linkopt.startswith("'") and linkopt.endswith("'"):
             linkopt = linkopt[1:-1]
 
-        skip_next = _LD_SKIP_OPTS.get(linkopt, 0)
+        skip_next = skip_count(linkopt)
         if skip_next:
             skip_next -= 1
             continue
 
-        _process_linkopt(linkopt)
-        last_opt = linkopt
+        opt = linkopt
+        last_opt, previous_opt = linkopt, last_opt
+
+        if opt == "-filelist":
+            continue
+        if previous_opt == "-filelist":
+            if pending_linkopt is not None:
+                yield pending_linkopt
+                pending_linkopt = None
+            # `_process_filelist` applies quoting if needed
+            yield from _process_filelist(opt)
+            continue
+
+        if generated_product_paths.is_suffix_of(opt):
+            if previous_opt == "-force_load":
+                pending_linkopt = None
+            continue
+
+        drops_force_load = drop(opt)
+        if drops_force_load is not None:
+            if drops_force_load and previous_opt == "-force_load":
+                pending_linkopt = None
+            continue
+
+        if pending_linkopt is not None:
+            yield pending_linkopt
+        pending_linkopt = finish(opt)
+
+    if pending_linkopt is not None:
+        yield pending_linkopt
 
-    return processed_linkopts
+
+def _cache_key(
+        cache: params_worker.ParamsCache,
+        generated_product_paths_file: str,
+        is_framework: bool,
+        args_files: List[str]
+    ) -> Any:
+    key = cache.new_key()
+    cache.update_key(key, b"1" if is_framework else b"0")
+    cache.update_key_with_file(key, generated_product_paths_file)
+
+    # The arguments, and the contents of the filelists they reference
+    last_arg = None
+    for arg in _parse_args(args_files):
+        cache.update_key(key, arg.encode())
+
+        # Unquoted the same way as in `_process_linkopts`
+        if arg.startswith("'") and arg.endswith("'"):
+            arg = arg[1:-1]
+        if last_arg == "-filelist":
+            cache.update_key_with_file(key, arg)
+        last_arg = arg
+
+    return key
 
 
 def _main(
@@ -149,6 +186,20 @@ def _main(
         is_framework: bool,
         args_files: List[str]
     ) -> None:
+    cache = params_worker.ParamsCache.from_env(
+        name = _NAME,
+        sources = [__file__, flag_rules.__file__],
+    )
+    if cache:
+        key = _cache_key(
+            cache,
+            generated_product_paths_file,
+            is_framework,
+            args_files,
+        )
+        if cache.restore(key, output_path):
+            return
+
     with open(generated_product_paths_file, encoding = "utf-8") as fp:
         generated_product_paths = json.load(fp)
 
@@ -159,12 +210,20 @@ def _main(
     )
 
     with open(output_path, encoding = "utf-8", mode = "w") as fp:
-        result = "\n".join(linkopts)
-        fp.write(f'{result}\n')
+        wrote_linkopt = False
+        for linkopt in linkopts:
+            fp.write(f"{linkopt}\n")
+            wrote_linkopt = True
+        if not wrote_linkopt:
+            fp.write("\n")
 
+    if cache:
+        cache.store(key, output_path)
 
-if __name__ == "__main__":
-    if len(sys.argv) < 5:
+
+def _run(args: List[str]) -> int:
+    args = params_worker.expand_flagfile(args)
+    if len(args) < 4:
         print(
             f"""
 Usage: {sys.argv[0]} <output> <self_linked_outputs_file> <is_framework> \
@@ -172,11 +231,16 @@ Usage: {sys.argv[0]} <output> <self_linked_outputs_file> <is_framework> \
 """,
             file = sys.stderr,
         )
-        exit(1)
+        return 1
 
     _main(
-        sys.argv[1],
-        sys.argv[2],
-        sys.argv[3] == "1",
-        sys.argv[4:],
+        args[0],
+        args[1],
+        args[2] == "1",
+        args[3:],
     )
+    return 0
+
+
+if __name__ == "__main__":
+    params_worker.main(_run)
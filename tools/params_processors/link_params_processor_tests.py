@@ -0,0 +1,356 @@
+"""Tests for link_params_processor."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+from tools.params_processors import link_params_processor
+
+# The module the processor imports, which holds the caches it uses
+params_worker = link_params_processor.params_worker
+
+class link_params_processor_test(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.tmp = self._temp_dir.name
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w", encoding = "utf-8") as f:
+            f.write(content)
+        return path
+
+    def _write_inputs(self):
+        filelist = self._write(
+            "App.filelist",
+            "bazel-out/bin/libA.a\nbazel-out/bin/main.o\n"
+            "bazel-out/bin/libApp.a\nbazel-out/bin/with space.a\n",
+        )
+        generated_product_paths = self._write(
+            "generated_product_paths.json",
+            json.dumps(["bazel-out/bin/libApp.a"]),
+        )
+        link_params = self._write(
+            "link.params",
+            f"""\
+clang
+-o
+bazel-out/bin/App
+-target
+arm64-apple-ios15.0-simulator
+-filelist
+{filelist}
+-force_load
+bazel-out/bin/libApp.a
+'-Wl,-rpath,@executable_path/Frameworks'
+-F__BAZEL_XCODE_SDKROOT__/Developer/Library/Frameworks
+-Wl,-sectcreate,__TEXT,__info_plist,bazel-out/bin/Info.plist
+DSYM_HINT_LINKED_BINARY=bazel-out/bin/App
+-framework
+UIKit
+""",
+        )
+        return generated_product_paths, link_params
+
+    def test_process_linkopts(self):
+        generated_product_paths, link_params = self._write_inputs()
+        with open(generated_product_paths, encoding = "utf-8") as f:
+            product_paths = json.load(f)
+
+        self.assertEqual(
+            list(link_params_processor._process_linkopts(
+                linkopts = link_params_processor._parse_args([link_params]),
+                is_framework = False,
+                generated_product_paths = product_paths,
+            )),
+            [
+                "bazel-out/bin/libA.a",
+                "'bazel-out/bin/with space.a'",
+                "-Wl,-rpath,@executable_path/Frameworks",
+                "'-F$(SDKROOT)/Developer/Library/Frameworks'",
+                "-framework",
+                "UIKit",
+            ],
+        )
+
+    def test_drop_rules(self):
+        swizzle = "x/libswizzle_absolute_xcttestsourcelocation.a"
+        self.assertEqual(
+            list(link_params_processor._process_linkopts(
+                linkopts = [
+                    "-force_load",
+                    swizzle,
+                    "-force_load",
+                    "bazel-out/bin/libKeep.a",
+                    "-Wl,-sectcreate,__TEXT,__entitlements,a.entitlements",
+                    "-force_load",
+                    f"-Wl,-sectcreate,__TEXT,__info_plist,{swizzle}",
+                    "-force_load",
+                    f"DSYM_HINT_LINKED_BINARY={swizzle}",
+                    "DSYM_HINT_DSYM_PATH=x",
+                    "-L__BAZEL_XCODE_DEVELOPER_DIR__/L",
+                    "-Wl,$(X)",
+                    "-DNAME=\"v\"",
+                    "-lc++",
+                ],
+                is_framework = False,
+                generated_product_paths = [],
+            )),
+            [
+                "-force_load",
+                "bazel-out/bin/libKeep.a",
+                "-force_load",
+                "'-L$(DEVELOPER_DIR)/L'",
+                "'-Wl,$(X)'",
+                "-DNAME=\"v\"",
+                "-lc++",
+            ],
+        )
+
+    def test_shared_filelist(self):
+        filelist = self._write(
+            "Shared.filelist",
+            "bazel-out/bin/libA.a\nbazel-out/bin/main.o\nbazel-out/bin/libB.a\n",
+        )
+        first_params = self._write(
+            "first.params",
+            f"clang\n-filelist\n{filelist}\n-force_load\nbazel-out/bin/libB.a\n",
+        )
+        redirected_params = self._write(
+            "redirected.params",
+            f"-filelist\n{filelist}\n-lc++\n",
+        )
+        second_params = self._write("second.params", f"@{redirected_params}\n")
+
+        opened_paths = []
+        original_open = open
+        def _recording_open(path, *args, **kwargs):
+            opened_paths.append(path)
+            return original_open(path, *args, **kwargs)
+
+        linkopts = link_params_processor._process_linkopts(
+            linkopts = link_params_processor._parse_args(
+                [first_params, second_params],
+            ),
+            is_framework = False,
+            generated_product_paths = ["bazel-out/bin/libB.a"],
+        )
+        with unittest.mock.patch("builtins.open", _recording_open):
+            processed_linkopts = list(linkopts)
+
+        self.assertEqual(
+            processed_linkopts,
+            ["bazel-out/bin/libA.a", "bazel-out/bin/libA.a", "-lc++"],
+        )
+        self.assertEqual(opened_paths.count(filelist), 1)
+
+    def test_generated_product_paths(self):
+        paths = [
+            "bazel-out/bin/libApp.a",
+            "bazel-out/other/bin/libApp.a",
+            "bin/libLib.a",
+            "Lib.o",
+        ]
+        opts = [
+            "bazel-out/bin/libApp.a",
+            "-Wl,-force_load,bazel-out/bin/libApp.a",
+            "external/bazel-out/other/bin/libApp.a",
+            "bazel-out/bin/libApp.a.o",
+            "bazel-out/bin/libLib.a",
+            "-Lbin/libLib.a",
+            "bin/libLib.a/",
+            "bazel-out/bin/libLib.o",
+            "bazel-out/bin/Lib.o",
+            "-framework",
+            "",
+        ]
+        index = link_params_processor._GeneratedProductPaths(paths)
+
+        for opt in opts:
+            with self.subTest(opt = opt):
+                self.assertEqual(
+                    index.is_suffix_of(opt),
+                    any(opt.endswith(path) for path in paths),
+                )
+                self.assertEqual(opt in index, opt in paths)
+
+    def test_persistent_worker(self):
+        generated_product_paths, link_params = self._write_inputs()
+        requests = [
+            {
+                "arguments": [
+                    os.path.join(self.tmp, f"output{i}.params"),
+                    generated_product_paths,
+                    "0",
+                    link_params,
+                ],
+                "requestId": 0,
+            }
+            for i in range(3)
+        ] + [{"arguments": ["too", "few"], "requestId": 0}]
+
+        worker = subprocess.run(
+            [
+                sys.executable,
+                link_params_processor.__file__,
+                "--persistent_worker",
+            ],
+            input = "".join(json.dumps(r) + "\n" for r in requests),
+            stdout = subprocess.PIPE,
+            # Outside of the repository, as Bazel or a user might run it
+            cwd = self.tmp,
+            universal_newlines = True,
+            check = True,
+        )
+        responses = [json.loads(line) for line in worker.stdout.splitlines()]
+
+        self.assertEqual(
+            [response["exitCode"] for response in responses],
+            [0, 0, 0, 1],
+        )
+        self.assertIn("Usage:", responses[3]["output"])
+
+        one_shot_output = os.path.join(self.tmp, "one_shot.params")
+        flagfile = self._write(
+            "flagfile",
+            f"{one_shot_output}\n{generated_product_paths}\n0\n{link_params}\n",
+        )
+        subprocess.run(
+            [
+                sys.executable,
+                link_params_processor.__file__,
+                f"@{flagfile}",
+            ],
+            cwd = self.tmp,
+            check = True,
+        )
+        with open(one_shot_output, encoding = "utf-8") as f:
+            expected = f.read()
+        for i in range(3):
+            with open(
+                os.path.join(self.tmp, f"output{i}.params"),
+                encoding = "utf-8",
+            ) as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_cache(self):
+        generated_product_paths, link_params = self._write_inputs()
+        cache_dir = os.path.join(self.tmp, "cache")
+        filelist = os.path.join(self.tmp, "App.filelist")
+
+        def _process(output_name):
+            output = os.path.join(self.tmp, output_name)
+            link_params_processor._main(
+                output,
+                generated_product_paths,
+                False,
+                [link_params],
+            )
+            with open(output, encoding = "utf-8") as f:
+                return f.read()
+
+        def _stats():
+            params_worker.write_stats()
+            return params_worker.read_stats(cache_dir)
+
+        with unittest.mock.patch.dict(params_worker._CACHES), \
+                unittest.mock.patch.dict(
+                    os.environ,
+                    {"RULES_XCODEPROJ_PARAMS_CACHE_DIR": cache_dir},
+                ):
+            expected = _process("a.params")
+            with unittest.mock.patch.object(
+                link_params_processor,
+                "_process_linkopts",
+                side_effect = AssertionError("cache miss"),
+            ):
+                self.assertEqual(_process("b.params"), expected)
+            self.assertEqual(
+                _stats(),
+                {"hits": 1, "misses": 1, "evictions": 0},
+            )
+
+            # Filelist contents are part of the key
+            with open(filelist, "a", encoding = "utf-8") as f:
+                f.write("bazel-out/bin/libB.a\n")
+            expected_with_b = expected.replace(
+                "'bazel-out/bin/with space.a'\n",
+                "'bazel-out/bin/with space.a'\nbazel-out/bin/libB.a\n",
+            )
+            self.assertEqual(_process("c.params"), expected_with_b)
+            self.assertEqual(
+                _stats(),
+                {"hits": 1, "misses": 2, "evictions": 0},
+            )
+
+            # Including when `-filelist` and its path are quoted
+            with open(link_params, encoding = "utf-8") as f:
+                content = f.read()
+            with open(link_params, "w", encoding = "utf-8") as f:
+                f.write(content.replace(
+                    f"-filelist\n{filelist}\n",
+                    f"'-filelist'\n'{filelist}'\n",
+                ))
+            self.assertEqual(_process("e.params"), expected_with_b)
+            with open(filelist, "a", encoding = "utf-8") as f:
+                f.write("bazel-out/bin/libD.a\n")
+            self.assertEqual(
+                _process("f.params"),
+                expected_with_b.replace(
+                    "bazel-out/bin/libB.a\n",
+                    "bazel-out/bin/libB.a\nbazel-out/bin/libD.a\n",
+                ),
+            )
+            self.assertEqual(
+                _stats(),
+                {"hits": 1, "misses": 4, "evictions": 0},
+            )
+
+        # Only the most recently used entry fits, once the cache is maintained
+        with unittest.mock.patch.dict(params_worker._CACHES), \
+                unittest.mock.patch.object(
+                    params_worker,
+                    "_MAINTENANCE_INTERVAL",
+                    1,
+                ), \
+                unittest.mock.patch.dict(
+                    os.environ,
+                    {
+                        "RULES_XCODEPROJ_PARAMS_CACHE_DIR": cache_dir,
+                        "RULES_XCODEPROJ_PARAMS_CACHE_MAX_SIZE": (
+                            str(len(expected) + 100)
+                        ),
+                    },
+                ):
+            with open(filelist, "a", encoding = "utf-8") as f:
+                f.write("bazel-out/bin/libC.a\n")
+            _process("d.params")
+
+            self.assertEqual(
+                _stats(),
+                {"hits": 1, "misses": 5, "evictions": 4},
+            )
+        # Merged into `stats.json` by the maintenance
+        with open(
+            os.path.join(cache_dir, "stats.json"),
+            encoding = "utf-8",
+        ) as f:
+            self.assertEqual(
+                json.load(f),
+                {"hits": 1, "misses": 5, "evictions": 4},
+            )
+        self.assertEqual(
+            len(os.listdir(os.path.join(cache_dir, "link_params_processor"))),
+            1,
+        )
+
+if __name__ == '__main__':
+    unittest.main()
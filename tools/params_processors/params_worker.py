@@ -0,0 +1,362 @@
+"""Caching and persistent worker support shared by the params processors."""
+
+import atexit
+import contextlib
+import fcntl
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+
+# Opt-in cache of processed outputs, see `ParamsCache`
+_CACHE_DIR_ENV = "RULES_XCODEPROJ_PARAMS_CACHE_DIR"
+_CACHE_MAX_SIZE_ENV = "RULES_XCODEPROJ_PARAMS_CACHE_MAX_SIZE"
+_DEFAULT_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# The cache is maintained (evicted and its stats merged) at most once per this
+# many stores, across all processes using it
+_MAINTENANCE_INTERVAL = 64
+
+# Caches used by this process, see `ParamsCache.from_env`
+_CACHES = {}
+
+
+class ParamsCache:
+    """An opt-in, size-bounded on-disk cache of processed outputs.
+
+    Enabled by setting `RULES_XCODEPROJ_PARAMS_CACHE_DIR` to a directory that
+    actions can write to, which `ProcessLinkParams` actions do when the
+    `//xcodeproj:params_cache_dir` build setting is set. Entries are keyed by
+    a digest of the processor's sources and everything that affects its
+    output, so a hit is copied to the output path instead of processing the
+    inputs again.
+
+    Stores don't scan the cache or take a lock. Each store appends a byte to a
+    counter file, and once every `_MAINTENANCE_INTERVAL` stores one process
+    evicts the least recently used entries until the cache is at most
+    `RULES_XCODEPROJ_PARAMS_CACHE_MAX_SIZE` bytes. A process that stores
+    enough itself to go over that size (e.g. a persistent worker) evicts
+    sooner. So the cache can go over its size by up to
+    `_MAINTENANCE_INTERVAL` entries between evictions.
+
+    Hit, miss, and eviction counts are kept per process, and written to a file
+    in the `stats` directory when the process exits. Maintenance merges those
+    files into `stats.json`; `read_stats` returns the totals.
+
+    Cache errors are never fatal; they are treated as misses.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            max_size: int,
+            *,
+            name: str,
+            sources: List[str]
+        ) -> None:
+        """Initializes a cache.
+
+        Args:
+            directory: The cache directory, shared by all processors.
+            max_size: The size, in bytes, entries of this processor are
+                evicted down to.
+            name: The processor's name. Each processor keeps its entries in
+                a subdirectory with this name.
+            sources: Paths to the source files that determine the processor's
+                output. Their contents cover the processor version.
+        """
+        self._directory = directory
+        self._entries_directory = os.path.join(directory, name)
+        self._stores_path = os.path.join(directory, f"{name}.stores")
+        self._max_size = max_size
+
+        # The size of the entries as of this process' last maintenance, plus
+        # what it stored since. `None` until it maintains the cache.
+        self._size: Optional[int] = None
+
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+        sources_digest = hashlib.sha256()
+        for source in sources:
+            with open(source, "rb") as fp:
+                self.update_key(sources_digest, fp.read())
+        self._sources_digest = sources_digest.digest()
+
+    @classmethod
+    def from_env(
+            cls,
+            *,
+            name: str,
+            sources: List[str]
+        ) -> Optional["ParamsCache"]:
+        """Returns the cache configured in the environment, if any.
+
+        The same cache is returned for every call with the same configuration,
+        so a persistent worker keeps its stats and size between requests.
+        """
+        directory = os.getenv(_CACHE_DIR_ENV)
+        if not directory:
+            return None
+        try:
+            max_size = int(
+                os.getenv(_CACHE_MAX_SIZE_ENV, _DEFAULT_CACHE_MAX_SIZE),
+            )
+        except ValueError:
+            max_size = _DEFAULT_CACHE_MAX_SIZE
+
+        key = (directory, max_size, name, tuple(sources))
+        cache = _CACHES.get(key)
+        if not cache:
+            if not _CACHES:
+                atexit.register(write_stats)
+            cache = cls(directory, max_size, name = name, sources = sources)
+            _CACHES[key] = cache
+        return cache
+
+    def new_key(self) -> Any:
+        """Returns a digest already covering the processor version."""
+        return hashlib.sha256(self._sources_digest)
+
+    @staticmethod
+    def update_key(key: Any, data: bytes) -> None:
+        # Length prefixes keep different splits of the same bytes distinct
+        key.update(f"{len(data)}:".encode())
+        key.update(data)
+
+    @classmethod
+    def update_key_with_file(cls, key: Any, path: str) -> None:
+        with open(path, "rb") as fp:
+            cls.update_key(key, fp.read())
+
+    def restore(self, key: Any, output_path: str) -> bool:
+        """Copies the cached output for `key` to `output_path`, if any."""
+        entry = os.path.join(self._entries_directory, key.hexdigest())
+        try:
+            shutil.copyfile(entry, output_path)
+            # Mark the entry as recently used
+            os.utime(entry)
+        except OSError:
+            self._stats["misses"] += 1
+            return False
+
+        self._stats["hits"] += 1
+        return True
+
+    def store(self, key: Any, output_path: str) -> None:
+        """Adds `output_path` to the cache as the output for `key`."""
+        try:
+            os.makedirs(self._entries_directory, exist_ok = True)
+            entry = os.path.join(self._entries_directory, key.hexdigest())
+            temp_entry = f"{entry}.{os.getpid()}.tmp"
+            shutil.copyfile(output_path, temp_entry)
+            size = os.path.getsize(temp_entry)
+            os.replace(temp_entry, entry)
+
+            if self._size is not None:
+                self._size += size
+            if (self._count_store() or
+                (self._size is not None and self._size > self._max_size)):
+                self._maintain()
+        except OSError:
+            pass
+
+    def write_stats(self) -> None:
+        """Writes the stats not yet written to the `stats` directory."""
+        if not any(self._stats.values()):
+            return
+        try:
+            stats_directory = os.path.join(self._directory, "stats")
+            os.makedirs(stats_directory, exist_ok = True)
+            path = os.path.join(
+                stats_directory,
+                f"{os.getpid()}.{time.time_ns()}.json",
+            )
+            # Written to a temporary file first, so maintenance only reads
+            # complete files
+            with open(f"{path}.tmp", encoding = "utf-8", mode = "w") as fp:
+                json.dump(self._stats, fp)
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            return
+        self._stats = {name: 0 for name in self._stats}
+
+    def _count_store(self) -> bool:
+        """Counts a store, returning whether the cache is due maintenance."""
+        fd = os.open(
+            self._stores_path,
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            0o644,
+        )
+        try:
+            # Appends don't need a lock, and the count is the file's size
+            os.write(fd, b".")
+            return os.fstat(fd).st_size >= _MAINTENANCE_INTERVAL
+        finally:
+            os.close(fd)
+
+    def _maintain(self) -> None:
+        with open(
+            os.path.join(self._directory, "maintenance.lock"),
+            mode = "w",
+        ) as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is already maintaining the cache
+                return
+
+            os.truncate(self._stores_path, 0)
+            self._evict()
+            self.write_stats()
+            _merge_stats(self._directory)
+
+    def _evict(self) -> None:
+        entries = []
+        total_size = 0
+        with os.scandir(self._entries_directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        if total_size > self._max_size:
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self._max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+                self._stats["evictions"] += 1
+
+        self._size = total_size
+
+
+def _merge_stats(directory: str) -> None:
+    """Merges the per-process stats files into `stats.json`."""
+    stats_directory = os.path.join(directory, "stats")
+    stats = read_stats(directory, include_pending = False)
+    merged_paths = []
+    with contextlib.suppress(FileNotFoundError), \
+            os.scandir(stats_directory) as it:
+        for entry in it:
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, encoding = "utf-8") as fp:
+                    process_stats = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            for name, count in process_stats.items():
+                stats[name] = stats.get(name, 0) + count
+            merged_paths.append(entry.path)
+
+    stats_path = os.path.join(directory, "stats.json")
+    with open(f"{stats_path}.tmp", encoding = "utf-8", mode = "w") as fp:
+        json.dump(stats, fp)
+    os.replace(f"{stats_path}.tmp", stats_path)
+
+    # Only removed once they are counted in `stats.json`
+    for path in merged_paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def read_stats(directory: str, include_pending: bool = True) -> Dict[str, int]:
+    """Returns the hit, miss, and eviction counts of the cache in `directory`.
+
+    Includes the stats written by processes since the last maintenance, unless
+    `include_pending` is `False`.
+    """
+    stats = {"hits": 0, "misses": 0, "evictions": 0}
+    paths = [os.path.join(directory, "stats.json")]
+    if include_pending:
+        with contextlib.suppress(FileNotFoundError), \
+                os.scandir(os.path.join(directory, "stats")) as it:
+            paths.extend(
+                entry.path
+                for entry in it
+                if entry.name.endswith(".json")
+            )
+    for path in paths:
+        try:
+            with open(path, encoding = "utf-8") as fp:
+                for name, count in json.load(fp).items():
+                    stats[name] = stats.get(name, 0) + count
+        except (OSError, ValueError):
+            continue
+    return stats
+
+
+def write_stats() -> None:
+    """Writes the stats of every cache used by this process.
+
+    Called when the process exits.
+    """
+    for cache in _CACHES.values():
+        cache.write_stats()
+
+
+def expand_flagfile(args: List[str]) -> List[str]:
+    """Expands a lone `@flagfile` argument into the arguments it contains."""
+    if len(args) == 1 and args[0].startswith("@"):
+        with open(args[0][1:], encoding = "utf-8") as fp:
+            return fp.read().splitlines()
+    return args
+
+
+def run_persistent_worker(run: Callable[[List[str]], int]) -> None:
+    """Handles Bazel JSON persistent worker requests until stdin is closed.
+
+    Each request's arguments are passed to `run`, and its return value is the
+    response's exit code.
+
+    See https://bazel.build/remote/creating#work-request and
+    https://bazel.build/remote/creating#work-response.
+    """
+    stdout = sys.stdout
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), \
+                contextlib.redirect_stderr(output):
+            try:
+                exit_code = run(request.get("arguments", []))
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+
+        response = {
+            "exitCode": exit_code,
+            "output": output.getvalue(),
+        }
+        if "requestId" in request:
+            response["requestId"] = request["requestId"]
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+
+
+def main(run: Callable[[List[str]], int]) -> None:
+    """Runs a processor as a persistent worker or for a single action."""
+    if "--persistent_worker" in sys.argv[1:]:
+        run_persistent_worker(run)
+    else:
+        sys.exit(run(sys.argv[1:]))
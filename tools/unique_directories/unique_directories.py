@@ -1,29 +1,67 @@
 #!/usr/bin/python3
 
+import gc
 import os
 import sys
 
-def _insert_into_trie(trie, components):
-    if not components:
-        return
-    _insert_into_trie(trie.setdefault(components[0], {}), components[1:])
+def _unique_directories(directories):
+    """Returns the directories that aren't a parent of another directory.
 
-def _trie_to_list(trie, prefix_components, output):
-    for component, sub_trie in trie.items():
-        if not sub_trie:
-            output.append(os.sep.join(prefix_components + [component]))
+    The result is in the order of a depth-first walk of the directories, with
+    siblings in the order they were first seen.
+    """
+
+    # Every directory and parent directory seen so far, mapped to a list of
+    # its subdirectories in the order they were first seen, or `None` if it
+    # doesn't have any (yet). Keys are whole paths, so a new directory only
+    # walks up to the first parent that has already been seen.
+    tree = {}
+    roots = []
+
+    for directory in dict.fromkeys(directories):
+        if directory in tree:
+            continue
+        tree[directory] = None
+
+        while True:
+            separator_index = directory.rfind(os.sep)
+            if separator_index < 0:
+                roots.append(directory)
+                break
+
+            parent = directory[:separator_index]
+            is_known_parent = parent in tree
+            children = tree.get(parent)
+            if children is None:
+                tree[parent] = [directory]
+            else:
+                children.append(directory)
+
+            if is_known_parent:
+                break
+            directory = parent
+
+    # Walk the tree with an explicit stack, so there is no recursion limit on
+    # path depth
+    unique_directories = []
+    stack = [iter(roots)]
+    while stack:
+        for directory in stack[-1]:
+            children = tree[directory]
+            if children:
+                stack.append(iter(children))
+                break
+            unique_directories.append(directory)
         else:
-            _trie_to_list(sub_trie, prefix_components + [component], output)
+            stack.pop()
 
-def _main(input_filelist, output_filelist):
-    trie = {}
+    return unique_directories
 
+def _main(input_filelist, output_filelist):
     with open(input_filelist, 'r', encoding='utf-8') as fp:
-        for directory in fp:
-            _insert_into_trie(trie, directory.rstrip().split(os.sep))
-
-    directories = []
-    _trie_to_list(trie, [], directories)
+        directories = _unique_directories(
+            directory.rstrip() for directory in fp
+        )
 
     with open(output_filelist, 'w', encoding='utf-8') as fp:
         if directories:
@@ -37,4 +75,8 @@ if __name__ == "__main__":
         print("Usage: unique_directories.py <input.filelist> <output.filelist>")
         exit(1)
 
+    # Only lists of subdirectories are tracked by the garbage collector, and
+    # none of them are ever garbage, so collecting is pure overhead
+    gc.disable()
+
     _main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,66 @@
+"""Tests for unique_directories."""
+
+import gc
+import os
+import tempfile
+import unittest
+
+from tools.unique_directories import unique_directories
+
+class unique_directories_test(unittest.TestCase):
+
+    def test_unique_directories(self):
+        self.assertEqual(
+            unique_directories._unique_directories([
+                "bazel-out/bin/b/c",
+                "bazel-out/bin/a",
+                "bazel-out/bin/b",
+                "external/repo",
+                "bazel-out/bin/b/c/d",
+                "bazel-out/bin/a",
+                "bazel-out/bin/b/e",
+                "bazel-out/bin-other",
+                "/abs",
+                "/abs/a",
+                "",
+            ]),
+            [
+                "bazel-out/bin/b/c/d",
+                "bazel-out/bin/b/e",
+                "bazel-out/bin/a",
+                "bazel-out/bin-other",
+                "external/repo",
+                "/abs/a",
+            ],
+        )
+
+    def test_deep_directories(self):
+        directory = "/".join(["d"] * 5000)
+        self.assertEqual(
+            unique_directories._unique_directories(
+                [directory[:index] for index in range(1, len(directory) + 1, 2)],
+            ),
+            [directory],
+        )
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            input_filelist = os.path.join(tmp, "input.filelist")
+            output_filelist = os.path.join(tmp, "output.filelist")
+
+            with open(input_filelist, "w", encoding = "utf-8") as f:
+                f.write("a/b\na/b/c \na/d\n")
+            unique_directories._main(input_filelist, output_filelist)
+            with open(output_filelist, encoding = "utf-8") as f:
+                self.assertEqual(f.read(), "a/b/c\na/d\n")
+
+            with open(input_filelist, "w", encoding = "utf-8") as f:
+                f.write("")
+            unique_directories._main(input_filelist, output_filelist)
+            with open(output_filelist, encoding = "utf-8") as f:
+                self.assertEqual(f.read(), "")
+
+        self.assertTrue(gc.isenabled())
+
+if __name__ == '__main__':
+    unittest.main()
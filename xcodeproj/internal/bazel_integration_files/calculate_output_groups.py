@@ -1,12 +1,24 @@
 #!/usr/bin/python3
 
+import concurrent.futures
+import contextlib
 import datetime
-import glob
+import fcntl
+import hashlib
+import io
 import json
+import mmap
 import os
+import select
+import socket
+import struct
+import subprocess
 import sys
+import tempfile
+import threading
 import time
 import traceback
+import zlib
 
 # Ordered the same as we order platforms in the generated Xcode project, except
 # macOS is last
@@ -23,63 +35,357 @@ _SIMULATOR_PLATFORMS = {
     "macosx": None,
 }
 
+# `O_EVTONLY` (macOS only) lets us watch a directory without preventing the
+# volume it's on from being unmounted
+_O_EVTONLY = getattr(
+    os,
+    "O_EVTONLY",
+    0x8000 if sys.platform == "darwin" else os.O_RDONLY,
+)
 
-def _wait_for_value(calculate_value, value_name):
-    wait_counter = 0
-    while True:
-        value = calculate_value()
-        if value:
-            break
-        if wait_counter == 0:
-            now = datetime.datetime.now().strftime('%H:%M:%S')
+# Bounds, in seconds, of the adaptive timeout used while waiting for Xcode to
+# write files
+_MIN_POLL_INTERVAL = 0.005
+_MAX_POLL_INTERVAL = 0.25
+
+# Coarsest directory mtime granularity, in nanoseconds, we guard against when
+# deciding whether a directory has changed (HFS+ has one second timestamps)
+_SCANNER_MTIME_GRANULARITY = 1_000_000_000
+
+# Below this many target PIFs to parse, the cost of starting worker processes
+# is larger than the time saved by parsing in parallel
+_PARALLEL_PARSE_THRESHOLD = 500
+_PARALLEL_PARSE_MIN_SHARD_SIZE = 64
+
+# Above this many target PIFs to parse, only the ones needed by the build
+# request are parsed before calling Bazel
+_LAZY_RESOLUTION_THRESHOLD = 64
+
+# The guid payload is a memory mapped file, laid out as:
+#
+# - A header (`_GUID_PAYLOAD_HEADER`)
+# - A hash table of `slot_count` slots (`_GUID_PAYLOAD_SLOT`), each being
+#   `(guid string index + 1, label string index, target ids string index)`
+# - `string_count + 1` string offsets
+# - The UTF-8 encoded strings
+#
+# The target ids string is JSON (as returned by `_target_payload`), with target
+# ids replaced by string indexes.
+# Bump `_GUID_PAYLOAD_VERSION` when changing any of this.
+_GUID_PAYLOAD_MAGIC = b"RXGP"
+_GUID_PAYLOAD_VERSION = 2
+_GUID_PAYLOAD_HEADER = struct.Struct("<4sIII")
+_GUID_PAYLOAD_SLOT = struct.Struct("<III")
+
+# The daemon (enabled with `RULES_XCODEPROJ_OUTPUT_GROUPS_DAEMON=YES`) exits
+# after being idle for this many seconds
+_DAEMON_IDLE_TIMEOUT = 60 * 60
+# A daemon that doesn't answer within this many seconds is busy, in which case
+# it's faster to calculate the output groups in-process
+_DAEMON_QUERY_TIMEOUT = 0.25
+
+
+class _Tracer:
+    """Records spans and counters as Chrome trace events.
+
+    Enabled with `RULES_XCODEPROJ_OUTPUT_GROUPS_TRACE=YES`. The trace is written
+    to `$OBJROOT/rules_xcodeproj_logs/calculate_output_groups.trace.json`,
+    which can be opened with `chrome://tracing` or Perfetto.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._counters = {}
+        self._start = time.perf_counter()
+        self._start_time = datetime.datetime.now()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._events.append({
+                "name": name,
+                "ph": "X",
+                "ts": self._microseconds(start),
+                "dur": self._microseconds(time.perf_counter()) -
+                       self._microseconds(start),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            })
+
+    def count(self, name, value = 1):
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def write(self, path):
+        events = list(self._events)
+        if self._counters:
+            events.append({
+                "name": "counters",
+                "ph": "C",
+                "ts": self._microseconds(time.perf_counter()),
+                "pid": os.getpid(),
+                "args": self._counters,
+            })
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            _atomic_json_dump(
+                {
+                    "traceEvents": events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {
+                        "start": self._start_time.isoformat(),
+                        "argv": sys.argv[1:],
+                    },
+                },
+                path,
+            )
+        except OSError as error:
             print(
-                f"note: ({now}) {value_name} not updated yet, waiting...",
+                f"warning: Failed to write trace to '{path}': {error}",
                 file = sys.stderr,
-                flush = True,
             )
-        if wait_counter == 10:
-            now = datetime.datetime.now().strftime('%H:%M:%S')
-            print(
-                f"""\
+
+    def _microseconds(self, perf_counter):
+        return int((perf_counter - self._start) * 1_000_000)
+
+
+_TRACER = _Tracer()
+
+
+class _NewestEntryScanner:
+    """Finds the newest entry, by ctime, of a directory across polls.
+
+    If `immutable_entries` is `True`, entries are never changed after they are
+    created (e.g. the content-addressed project PIFs), so their ctimes are
+    remembered between polls. A poll then only stats the directory, and if it
+    changed reads it again and stats the entries it hasn't seen before.
+
+    Otherwise every matching entry is stat'd on each poll. Xcode reuses
+    existing entries (e.g. it writes a new `build-request.json` into an
+    existing `.xcbuilddata` directory), so any of them can become the newest
+    without the directory itself changing. `os.scandir` keeps each poll to a
+    single directory read.
+    """
+
+    def __init__(self, directory, matches, immutable_entries = False):
+        self._directory = directory
+        self._matches = matches
+        self._immutable_entries = immutable_entries
+        self._directory_mtime = None
+
+        # `(entry path, inode) -> ctime` of the entries seen by the last poll,
+        # if `immutable_entries`. The inode catches an entry being replaced.
+        self._ctimes = {}
+        self._newest = None
+
+    def newest(self):
+        """Returns `(path, ctime)` of the newest matching entry, or `None`."""
+        if not self._immutable_entries:
+            return self._scan()
+
+        try:
+            directory_mtime = os.stat(self._directory).st_mtime_ns
+        except FileNotFoundError:
+            self._directory_mtime = None
+            self._ctimes = {}
+            self._newest = None
+            return None
+
+        if (directory_mtime != self._directory_mtime or
+            # Entries created in the same timestamp tick as our last read
+            # wouldn't change the directory's mtime
+            time.time_ns() - directory_mtime < _SCANNER_MTIME_GRANULARITY):
+            self._directory_mtime = directory_mtime
+            self._newest = self._scan()
+
+        return self._newest
+
+    def _scan(self):
+        newest = None
+        ctimes = {}
+        try:
+            with os.scandir(self._directory) as entries:
+                for entry in entries:
+                    if not self._matches(entry.name):
+                        continue
+                    key = (entry.path, entry.inode())
+                    ctime = self._ctimes.get(key)
+                    if ctime is None:
+                        try:
+                            ctime = entry.stat().st_ctime
+                        except FileNotFoundError:
+                            # Removed since we listed the directory
+                            continue
+                    if self._immutable_entries:
+                        ctimes[key] = ctime
+                    if not newest or ctime > newest[1]:
+                        newest = (entry.path, ctime)
+        except FileNotFoundError:
+            pass
+
+        self._ctimes = ctimes
+        return newest
+
+
+class _DirectoryWatcher:
+    """Blocks until watched directories change, or until a timeout.
+
+    Uses `kqueue` to be woken up as soon as an entry is added to or removed
+    from a watched directory. Where `kqueue` isn't available, or a directory
+    doesn't exist yet, this falls back to polling. In both cases the timeout
+    starts at a few milliseconds and backs off, so a missed event can only cost
+    `_MAX_POLL_INTERVAL`.
+    """
+
+    def __init__(self):
+        if hasattr(select, "kqueue"):
+            self._kqueue = select.kqueue()
+        else:
+            self._kqueue = None
+        self._fds = {}
+        self._poll_interval = _MIN_POLL_INTERVAL
+
+    def wait(self, paths):
+        if self._kqueue:
+            self._watch(paths)
+
+        timeout = self._poll_interval
+        self._poll_interval = min(timeout * 2, _MAX_POLL_INTERVAL)
+
+        if self._fds:
+            if self._kqueue.control(None, len(self._fds), timeout):
+                # Something changed, so whatever we write next is likely to
+                # follow shortly after
+                self._poll_interval = _MIN_POLL_INTERVAL
+        else:
+            time.sleep(timeout)
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+        if self._kqueue:
+            self._kqueue.close()
+            self._kqueue = None
+
+    def _watch(self, paths):
+        for path in set(self._fds) - set(paths):
+            os.close(self._fds.pop(path))
+
+        for path in paths:
+            if path in self._fds:
+                continue
+            try:
+                fd = os.open(path, _O_EVTONLY)
+            except OSError:
+                # Doesn't exist yet, we will try again on the next wait
+                continue
+            self._fds[path] = fd
+            self._kqueue.control(
+                [
+                    select.kevent(
+                        fd,
+                        filter = select.KQ_FILTER_VNODE,
+                        flags = (
+                            select.KQ_EV_ADD |
+                            select.KQ_EV_ENABLE |
+                            select.KQ_EV_CLEAR
+                        ),
+                        fflags = (
+                            select.KQ_NOTE_WRITE |
+                            select.KQ_NOTE_EXTEND |
+                            select.KQ_NOTE_RENAME |
+                            select.KQ_NOTE_DELETE
+                        ),
+                    ),
+                ],
+                0,
+                0,
+            )
+
+
+def _wait_for_value(calculate_value, value_name, watch_paths):
+    value = calculate_value()
+    if value:
+        return value
+
+    start = time.monotonic()
+    now = datetime.datetime.now().strftime('%H:%M:%S')
+    print(
+        f"note: ({now}) {value_name} not updated yet, waiting...",
+        file = sys.stderr,
+        flush = True,
+    )
+
+    warned = False
+    watcher = _DirectoryWatcher()
+    try:
+        while True:
+            watcher.wait(watch_paths())
+            value = calculate_value()
+            if value:
+                break
+            if not warned and time.monotonic() - start >= 10:
+                warned = True
+                now = datetime.datetime.now().strftime('%H:%M:%S')
+                print(
+                    f"""\
 warning: ({now}) {value_name} still not updated after 10 seconds. If happens \
 frequently, or the cache is never created, please file a bug report here: \
 https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md""",
-                file = sys.stderr,
-                flush = True,
-            )
-        time.sleep(1)
-        wait_counter += 1
-    if wait_counter > 0:
-        now = datetime.datetime.now().strftime('%H:%M:%S')
-        print(
-                f"""\
-note: ({now}) {value_name} updated after {wait_counter} seconds.""",
-                file = sys.stderr,
-                flush = True,
-        )
+                    file = sys.stderr,
+                    flush = True,
+                )
+    finally:
+        watcher.close()
+
+    waited = time.monotonic() - start
+    now = datetime.datetime.now().strftime('%H:%M:%S')
+    print(
+            f"""\
+note: ({now}) {value_name} updated after {waited:.3f} seconds.""",
+            file = sys.stderr,
+            flush = True,
+    )
     return value
 
 
-def _get_build_request(
+def _get_build_request_path(
         xcode_version,
         objroot,
         build_request_min_ctime):
+    xcbuilddata_dir = f"{objroot}/XCBuildData"
+
     if xcode_version < 1430:
         # Before Xcode 14.3
+        build_description_caches = _NewestEntryScanner(
+            xcbuilddata_dir,
+            lambda name: name.startswith("BuildDescriptionCacheIndex-"),
+        )
+
         def wait_for_description():
-            build_description_cache = max(
-                glob.iglob(
-                    f"{objroot}/XCBuildData/BuildDescriptionCacheIndex-*",
-                ),
-                key = os.path.getctime,
-            )
-            if (os.path.getctime(build_description_cache) >=
-                build_request_min_ctime):
+            newest = build_description_caches.newest()
+            if not newest:
+                return None
+            build_description_cache, ctime = newest
+            if ctime >= build_request_min_ctime:
                 return build_description_cache
             return None
 
-        build_description_cache = (
-            _wait_for_value(wait_for_description, "BuildDescriptionCacheIndex")
+        build_description_cache = _wait_for_value(
+            wait_for_description,
+            "BuildDescriptionCacheIndex",
+            lambda: [xcbuilddata_dir],
         )
         with open(build_description_cache, 'rb') as f:
             f.seek(-32, os.SEEK_END)
@@ -90,65 +396,68 @@ def _get_build_request(
         )
         def wait_for_build_request_file():
             if os.path.exists(build_request_file):
-                with open(build_request_file, encoding = "utf-8") as f:
-                    # Parse the build-request.json file
-                    try:
-                        return json.load(f)
-                    except Exception as error:
-                        print(
-                            f"""\
-error: Failed to parse '{build_request_file}':
-{type(error).__name__}: {error}.
-
-Please file a bug report here: \
-https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md""",
-                            file = sys.stderr,
-                        )
-                        exit(1)
+                return build_request_file
             return None
 
         return _wait_for_value(
             wait_for_build_request_file,
             f"\"{build_request_file}\"",
+            lambda: [xcbuilddata_dir],
         )
 
+    # `build-request.json` is written inside of the newest `.xcbuilddata`
+    # directory, so once we've found that we watch it as well
+    newest_xcbuilddata = None
+    xcbuilddatas = _NewestEntryScanner(
+        xcbuilddata_dir,
+        lambda name: name.endswith(".xcbuilddata"),
+    )
+
     def wait_for_build_request():
-        try:
-            xcbuilddata = max(
-                glob.iglob(f"{objroot}/XCBuildData/*.xcbuilddata"),
-                key = os.path.getctime,
-            )
-            if os.path.getctime(xcbuilddata) < build_request_min_ctime:
-                return None
-        except (ValueError, FileNotFoundError, OSError):
-            # ValueError: no .xcbuilddata files yet (empty glob)
-            # FileNotFoundError/OSError: TOCTOU race - file deleted between glob and getctime
+        nonlocal newest_xcbuilddata
+        newest = xcbuilddatas.newest()
+        if not newest:
+            return None
+        xcbuilddata, ctime = newest
+        if ctime < build_request_min_ctime:
             return None
+        newest_xcbuilddata = xcbuilddata
         build_request_file = f"{xcbuilddata}/build-request.json"
         if os.path.exists(build_request_file):
-            with open(build_request_file, encoding = "utf-8") as f:
-                # Parse the build-request.json file
-                try:
-                    return json.load(f)
-                except Exception as error:
-                    print(
-                        f"""\
-error: Failed to parse '{build_request_file}':
-{type(error).__name__}: {error}.
-
-Please file a bug report here: \
-https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md""",
-                        file = sys.stderr,
-                    )
-                    sys.exit(1)
+            return build_request_file
         return None
 
     return _wait_for_value(
         wait_for_build_request,
         "newest 'buildRequest.json' file",
+        lambda: [
+            path
+            for path in (xcbuilddata_dir, newest_xcbuilddata)
+            if path
+        ],
     )
 
 
+def _load_build_request(build_request_file):
+    with open(build_request_file, encoding = "utf-8") as f:
+        # Parse the build-request.json file
+        try:
+            build_request = json.load(f)
+            _TRACER.count("bytes_read", f.tell())
+            return build_request
+        except Exception as error:
+            print(
+                f"""\
+error: Failed to parse '{build_request_file}':
+{type(error).__name__}: {error}.
+
+Please file a bug report here: \
+https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md""",
+                file = sys.stderr,
+            )
+            sys.exit(1)
+
+
 def _calculate_label_and_target_ids(
         build_request,
         guid_labels,
@@ -181,7 +490,7 @@ def _calculate_label_and_target_ids(
             # isn't a different compile target id
             full_target_target_ids["build"]
         )
-        target_ids = _select_target_ids(
+        target_ids = _select_resolved_target_ids(
             target_target_ids[configuration_name],
             platform,
         )
@@ -204,7 +513,10 @@ https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bu
     return labels_and_target_ids
 
 
-def _calculate_guid_labels_and_target_ids(base_objroot):
+def _calculate_guid_labels_and_target_ids(
+        base_objroot,
+        guids = None,
+        complete_in_background = True):
     pif_cache = f"{base_objroot}/XCBuildData/PIFCache"
     project_cache = f"{pif_cache}/project"
     target_cache = f"{pif_cache}/target"
@@ -225,103 +537,623 @@ https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bu
         )
         sys.exit(1)
 
-    project_pif = max(
-        glob.iglob(f"{project_cache}/*"),
-        key = os.path.getctime,
-    )
+    with _TRACER.span("find_project_pif"):
+        project_pif = _newest_project_pif(base_objroot)
 
     guid_payload_parent = f"{base_objroot}/guid_payload"
     guid_payload_path = f"""\
-{guid_payload_parent}/{os.path.basename(project_pif)}_v2.json"""
+{guid_payload_parent}/{os.path.basename(project_pif)}.bin"""
 
-    if os.path.exists(guid_payload_path):
-        with open(guid_payload_path, encoding = "utf-8") as f:
-            payload = json.load(f)
-            return payload["labels"], payload["targetIds"]
+    # If the payload was written with a different format version, or is
+    # truncated or corrupt, this returns `None` and we regenerate it below
+    with _TRACER.span("read_guid_payload"):
+        payload = _read_guid_payload(guid_payload_path, guids)
+    if payload:
+        _TRACER.count("guid_payload_hits")
+        return payload
+    _TRACER.count("guid_payload_misses")
 
-    with open(project_pif, encoding = "utf-8") as f:
+    with _TRACER.span("load_project_pif"), open(
+        project_pif,
+        encoding = "utf-8",
+    ) as f:
         project_pif = json.load(f)
+        _TRACER.count("bytes_read", f.tell())
 
     targets = project_pif["targets"]
 
+    # Target PIF file names contain a hash of their content, so an entry for a
+    # given name never goes stale. This lets us only parse the target PIFs that
+    # changed since the last time the project PIF changed.
+    target_payloads_path = f"{guid_payload_parent}/targets_v2.json"
+    try:
+        with _TRACER.span("load_target_payloads"), open(
+            target_payloads_path,
+            encoding = "utf-8",
+        ) as f:
+            cached_target_payloads = json.load(f)
+            _TRACER.count("bytes_read", f.tell())
+    except (OSError, ValueError):
+        cached_target_payloads = {}
+
+    missing_target_names = [
+        target_name
+        for target_name in dict.fromkeys(targets)
+        if target_name not in cached_target_payloads
+    ]
+
+    if (guids is not None and
+        len(missing_target_names) > _LAZY_RESOLUTION_THRESHOLD):
+        # Only resolve the GUIDs in the build request now, and complete the
+        # payload out of band, so the time to the first Bazel invocation
+        # scales with the size of the scheme instead of the project
+        with _TRACER.span("resolve_guids", guids = len(guids)):
+            guid_labels, guid_target_ids, parsed_target_payloads = (
+                _resolve_guids(
+                    guids,
+                    targets,
+                    target_cache,
+                    cached_target_payloads,
+                )
+            )
+        _TRACER.count("target_pifs_parsed", len(parsed_target_payloads))
+
+        print(
+            f"""\
+note: Parsed {len(parsed_target_payloads)} target PIFs for the build request, \
+completing the payload in the background""",
+            file = sys.stderr,
+        )
+
+        if parsed_target_payloads:
+            os.makedirs(guid_payload_parent, exist_ok = True)
+            with _TRACER.span("write_target_payloads"):
+                _atomic_json_dump(
+                    {**cached_target_payloads, **parsed_target_payloads},
+                    target_payloads_path,
+                )
+        if complete_in_background:
+            _complete_guid_payload_in_background(base_objroot)
+
+        return guid_labels, guid_target_ids
+
+    with _TRACER.span("parse_target_pifs", count = len(missing_target_names)):
+        parsed_target_payloads = dict(
+            zip(
+                missing_target_names,
+                _parse_target_pifs(
+                    [
+                        f"{target_cache}/{target_name}-json"
+                        for target_name in missing_target_names
+                    ],
+                ),
+            ),
+        )
+    misses = len(missing_target_names)
+    hits = len(targets) - misses
+    _TRACER.count("target_pifs_parsed", misses)
+    _TRACER.count("target_payload_hits", hits)
+    _TRACER.count("target_payload_misses", misses)
+
+    target_payloads = {
+        target_name: (
+            parsed_target_payloads[target_name]
+            if target_name in parsed_target_payloads
+            else cached_target_payloads[target_name]
+        )
+        for target_name in targets
+    }
+
     guid_labels = {}
     guid_target_ids = {}
-    for target_name in targets:
-        target_file = f"{target_cache}/{target_name}-json"
-        with open(target_file, encoding = "utf-8") as f:
-            target_pif = json.load(f)
-
-        label = None
-        build_target_ids = {}
-        compile_target_ids = {}
-        for configuration in target_pif["buildConfigurations"]:
-            config_build_target_ids = {"key": "BAZEL_TARGET_ID"}
-            config_compile_target_ids = {"key": "BAZEL_COMPILE_TARGET_IDS"}
-            for key, value in configuration["buildSettings"].items():
-                if key.startswith("BAZEL_TARGET_ID"):
-                    # This uses a list in the case where the value isn't meant to
-                    # be inherited. Otherwise, `$(BAZEL_TARGET_ID)` is used later
-                    # in this processing to pull from an inherited setting.
-                    if value == "$(BAZEL_TARGET_ID)":
-                        target_ids = value
-                    else:
-                        # This is only a single value but the later parsing of
-                        # these target ids assumes a list.
-                        target_ids = [value]
-
-                    config_build_target_ids[_platform_from_build_key(key)] = (
-                        target_ids
-                    )
-                elif key.startswith("BAZEL_COMPILE_TARGET_IDS"):
-                    # This uses a list in the case where the value isn't meant to
-                    # be inherited. Otherwise, `$(BAZEL_COMPILE_TARGET_IDS)` is
-                    # used later in this processing to pull from an inherited
-                    # setting.
-                    if value == "$(BAZEL_COMPILE_TARGET_IDS)":
-                        target_ids = "$(BAZEL_COMPILE_TARGET_IDS)"
-                    else:
-                        # Target identifiers contain a space but are space separated.
-                        # Split on all spaces then rejoin across the identifier pairs.
-                        target_ids = value.split(" ")
-                        target_ids = [
-                            " ".join(target_ids[i:i+2])
-                            for i in range(0, len(target_ids), 2)
-                        ]
-
-                    config_compile_target_ids[_platform_from_compile_key(key)] = (
-                        target_ids
-                    )
-                elif key == "BAZEL_LABEL":
-                    label = value
-            configuration_name = configuration["name"]
-            build_target_ids[configuration_name] = config_build_target_ids
-            compile_target_ids[configuration_name] = config_compile_target_ids
-
+    for target_payload in target_payloads.values():
+        guid, label, target_ids = target_payload
         if not label:
             # `BazelDependency` and the like
             continue
-
-        target_ids = {
-            "build": build_target_ids,
-        }
-        if len(compile_target_ids) > 1:
-            target_ids["buildFiles"] = compile_target_ids
-
-        guid = target_pif["guid"]
         guid_labels[guid] = label
         guid_target_ids[guid] = target_ids
 
+    print(
+        f"""\
+note: Parsed {misses} target PIFs ({hits} reused from the previous payload)""",
+        file = sys.stderr,
+    )
+
     os.makedirs(guid_payload_parent, exist_ok = True)
-    with open(guid_payload_path, "w", encoding = "utf-8") as f:
-        payload = {
-            "labels": guid_labels,
-            "targetIds": guid_target_ids,
+    with _TRACER.span("write_guid_payload"):
+        _write_guid_payload(guid_payload_path, guid_labels, guid_target_ids)
+
+    if misses or len(cached_target_payloads) != len(target_payloads):
+        # Entries for targets no longer in the project are dropped, to keep
+        # this from growing unbounded
+        with _TRACER.span("write_target_payloads"):
+            _atomic_json_dump(target_payloads, target_payloads_path)
+
+    return guid_labels, guid_target_ids
+
+
+# Project PIFs are content-addressed, so their scanners are kept across calls
+# (e.g. the daemon's), to only stat new project PIFs
+_PROJECT_PIF_SCANNERS = {}
+
+
+def _newest_project_pif(base_objroot):
+    project_cache = f"{base_objroot}/XCBuildData/PIFCache/project"
+    scanner = _PROJECT_PIF_SCANNERS.get(project_cache)
+    if not scanner:
+        scanner = _NewestEntryScanner(
+            project_cache,
+            lambda name: True,
+            immutable_entries = True,
+        )
+        _PROJECT_PIF_SCANNERS[project_cache] = scanner
+    newest = scanner.newest()
+    if not newest:
+        raise FileNotFoundError(f"No project PIF found in '{project_cache}'")
+    return newest[0]
+
+
+def _resolve_guids(
+        guids,
+        target_names,
+        target_cache,
+        cached_target_payloads):
+    guid_labels = {}
+    guid_target_ids = {}
+    remaining_guids = set(guids)
+
+    def add_target_payload(target_payload):
+        guid, label, target_ids = target_payload
+        if guid not in remaining_guids:
+            return
+        remaining_guids.remove(guid)
+        if label:
+            guid_labels[guid] = label
+            guid_target_ids[guid] = target_ids
+
+    missing_target_names = []
+    for target_name in target_names:
+        if target_name in cached_target_payloads:
+            target_payload = cached_target_payloads[target_name]
+            if target_payload:
+                add_target_payload(target_payload)
+        else:
+            missing_target_names.append(target_name)
+
+    parsed_target_payloads = {}
+    for target_name in missing_target_names:
+        if not remaining_guids:
+            break
+
+        with open(f"{target_cache}/{target_name}-json", "rb") as f:
+            content = f.read()
+        _TRACER.count("bytes_read", len(content))
+
+        # A target PIF contains its own GUID, so we can skip parsing any that
+        # don't contain one we are looking for. Target PIFs also reference
+        # the GUIDs of their dependencies, so a match still needs to be
+        # confirmed by parsing.
+        if not any(
+            f'"{guid}"'.encode("utf-8") in content
+            for guid in remaining_guids
+        ):
+            continue
+
+        target_payload = _target_payload(json.loads(content))
+        parsed_target_payloads[target_name] = target_payload
+        add_target_payload(target_payload)
+
+    return guid_labels, guid_target_ids, parsed_target_payloads
+
+
+def _complete_guid_payload_in_background(base_objroot):
+    guid_payload_parent = f"{base_objroot}/guid_payload"
+    os.makedirs(guid_payload_parent, exist_ok = True)
+
+    # Only one completion runs at a time, as it can parse every target PIF in
+    # parallel. The locked file descriptor is inherited by the background
+    # process, so the lock is held until it exits.
+    lock_fd = os.open(
+        f"{guid_payload_parent}/complete.lock",
+        os.O_WRONLY | os.O_CREAT,
+        0o644,
+    )
+    try:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Already being completed
+            return
+        _run_in_background(
+            "--complete_guid_payload",
+            base_objroot,
+            pass_fds = (lock_fd,),
+        )
+    finally:
+        os.close(lock_fd)
+
+
+def _run_in_background(*args, pass_fds = ()):
+    # Detached, with no inherited pipes, so neither Xcode nor
+    # `generate_bazel_dependencies.sh` wait on it
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), *args],
+        stdin = subprocess.DEVNULL,
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.DEVNULL,
+        pass_fds = pass_fds,
+        start_new_session = True,
+    )
+
+
+def _parse_target_pifs(target_files):
+    jobs = os.cpu_count() or 1
+    if jobs < 2 or len(target_files) < _PARALLEL_PARSE_THRESHOLD:
+        return [
+            _parse_target_pif(target_file)
+            for target_file in target_files
+        ]
+
+    # Parsing is CPU bound, so we use processes instead of threads. Each shard
+    # is large enough to amortize the cost of sending results back.
+    shard_size = max(
+        _PARALLEL_PARSE_MIN_SHARD_SIZE,
+        -(-len(target_files) // (jobs * 4)),
+    )
+    shards = [
+        target_files[i:i + shard_size]
+        for i in range(0, len(target_files), shard_size)
+    ]
+    if _TRACER.enabled:
+        # Counts made in the worker processes are lost
+        _TRACER.count(
+            "bytes_read",
+            sum(os.path.getsize(target_file) for target_file in target_files),
+        )
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers = min(jobs, len(shards)),
+        ) as executor:
+            # `map` returns results in order, so the merged results are
+            # identical to parsing serially
+            return [
+                target_payload
+                for shard_payloads in executor.map(
+                    _parse_target_pif_shard,
+                    shards,
+                )
+                for target_payload in shard_payloads
+            ]
+    except (OSError, concurrent.futures.BrokenExecutor):
+        # Process creation can fail in restricted environments (e.g. too many
+        # open processes), so fall back to parsing serially
+        return [
+            _parse_target_pif(target_file)
+            for target_file in target_files
+        ]
+
+
+def _parse_target_pif_shard(target_files):
+    return [_parse_target_pif(target_file) for target_file in target_files]
+
+
+def _parse_target_pif(target_file):
+    with open(target_file, encoding = "utf-8") as f:
+        target_pif = json.load(f)
+        _TRACER.count("bytes_read", f.tell())
+    return _target_payload(target_pif)
+
+
+def _target_payload(target_pif):
+    label = None
+    build_target_ids = {}
+    compile_target_ids = {}
+    for configuration in target_pif["buildConfigurations"]:
+        config_build_target_ids = {"key": "BAZEL_TARGET_ID"}
+        config_compile_target_ids = {"key": "BAZEL_COMPILE_TARGET_IDS"}
+        for key, value in configuration["buildSettings"].items():
+            if key.startswith("BAZEL_TARGET_ID"):
+                # This uses a list in the case where the value isn't meant to
+                # be inherited. Otherwise, `$(BAZEL_TARGET_ID)` is used later
+                # in this processing to pull from an inherited setting.
+                if value == "$(BAZEL_TARGET_ID)":
+                    target_ids = value
+                else:
+                    # This is only a single value but the later parsing of
+                    # these target ids assumes a list.
+                    target_ids = [value]
+
+                config_build_target_ids[_platform_from_build_key(key)] = (
+                    target_ids
+                )
+            elif key.startswith("BAZEL_COMPILE_TARGET_IDS"):
+                # This uses a list in the case where the value isn't meant to
+                # be inherited. Otherwise, `$(BAZEL_COMPILE_TARGET_IDS)` is
+                # used later in this processing to pull from an inherited
+                # setting.
+                if value == "$(BAZEL_COMPILE_TARGET_IDS)":
+                    target_ids = "$(BAZEL_COMPILE_TARGET_IDS)"
+                else:
+                    # Target identifiers contain a space but are space
+                    # separated. Split on all spaces then rejoin across the
+                    # identifier pairs.
+                    target_ids = value.split(" ")
+                    target_ids = [
+                        " ".join(target_ids[i:i+2])
+                        for i in range(0, len(target_ids), 2)
+                    ]
+
+                config_compile_target_ids[_platform_from_compile_key(key)] = (
+                    target_ids
+                )
+            elif key == "BAZEL_LABEL":
+                label = value
+        configuration_name = configuration["name"]
+        build_target_ids[configuration_name] = config_build_target_ids
+        compile_target_ids[configuration_name] = config_compile_target_ids
+
+    guid = target_pif["guid"]
+
+    if not label:
+        # `BazelDependency` and the like. We still record the GUID, so lazy
+        # resolution knows it doesn't need to look for it.
+        return guid, None, None
+
+    target_ids = {
+        "build": _resolve_configurations_target_ids(build_target_ids),
+    }
+    if len(compile_target_ids) > 1:
+        target_ids["buildFiles"] = _resolve_configurations_target_ids(
+            compile_target_ids,
+        )
+
+    return guid, label, target_ids
+
+
+def _resolve_configurations_target_ids(configurations_target_ids):
+    return {
+        configuration_name: _resolve_target_ids(target_ids)
+        for configuration_name, target_ids in configurations_target_ids.items()
+    }
+
+
+def _resolve_target_ids(target_ids):
+    # Selecting target ids only depends on the PIF and the platform, so we do
+    # it for every platform when creating the payload. At build time,
+    # `_select_resolved_target_ids` then only needs a lookup or two. Platforms
+    # that resolve the same as their platform family aren't stored, to keep
+    # the payload small.
+    family_target_ids = {
+        "device": _first_platform_target_ids(target_ids, _DEVICE_PLATFORMS),
+        "simulator": _first_platform_target_ids(
+            target_ids,
+            _SIMULATOR_PLATFORMS,
+        ),
+    }
+
+    platforms_target_ids = {}
+    for platform in (
+        list(_DEVICE_PLATFORMS) +
+        list(_SIMULATOR_PLATFORMS) +
+        [key for key in target_ids if key not in ("", "key")]
+    ):
+        platform_target_ids = _select_target_ids(target_ids, platform)
+        if platform_target_ids != family_target_ids[_platform_family(platform)]:
+            platforms_target_ids[platform] = platform_target_ids
+
+    return {
+        "platforms": platforms_target_ids,
+        **family_target_ids,
+    }
+
+
+def _map_target_ids(value, transform):
+    if isinstance(value, list):
+        return [transform(target_id) for target_id in value]
+    if isinstance(value, dict):
+        return {
+            key: _map_target_ids(sub_value, transform)
+            for key, sub_value in value.items()
         }
-        json.dump(payload, f)
+    return value
+
+
+def _write_guid_payload(path, guid_labels, guid_target_ids):
+    strings = {}
+
+    def intern(string):
+        index = strings.get(string)
+        if index is None:
+            index = len(strings)
+            strings[string] = index
+        return index
+
+    # Open addressed hash table, with at most half of the slots used, so
+    # lookups only need to probe a slot or two
+    slot_count = 1
+    while slot_count < len(guid_labels) * 2:
+        slot_count *= 2
+
+    slots = [(0, 0, 0)] * slot_count
+    for guid, label in guid_labels.items():
+        target_ids = _map_target_ids(guid_target_ids[guid], intern)
+        slot = _guid_payload_slot(guid.encode("utf-8"), slot_count)
+        while slots[slot][0]:
+            slot = (slot + 1) % slot_count
+        slots[slot] = (
+            # `0` marks an empty slot
+            intern(guid) + 1,
+            intern(label),
+            intern(json.dumps(target_ids, separators = (",", ":"))),
+        )
+
+    encoded_strings = [string.encode("utf-8") for string in strings]
+    string_offsets = [0]
+    for encoded_string in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(encoded_string))
+
+    temp_path = _temp_path(path)
+    with open(temp_path, "wb") as f:
+        f.write(
+            _GUID_PAYLOAD_HEADER.pack(
+                _GUID_PAYLOAD_MAGIC,
+                _GUID_PAYLOAD_VERSION,
+                slot_count,
+                len(encoded_strings),
+            ),
+        )
+        f.write(
+            b"".join(_GUID_PAYLOAD_SLOT.pack(*slot) for slot in slots),
+        )
+        f.write(struct.pack(f"<{len(string_offsets)}I", *string_offsets))
+        f.write(b"".join(encoded_strings))
+    os.replace(temp_path, path)
+
+
+def _read_guid_payload(path, guids):
+    """Reads the labels and target ids of `guids` (or all GUIDs if `None`).
+
+    Returns `None` if the payload is missing, was written with a different
+    format version, or is truncated or otherwise corrupt.
+    """
+    try:
+        with open(path, "rb") as f:
+            payload = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Missing or empty
+        return None
+
+    with payload:
+        try:
+            return _decode_guid_payload(payload, guids)
+        except (
+            IndexError,
+            KeyError,
+            TypeError,
+            ValueError,
+            struct.error,
+        ):
+            # Corrupt, e.g. partially written by an older version. Callers
+            # regenerate it.
+            return None
+
+
+def _decode_guid_payload(payload, guids):
+    if len(payload) < _GUID_PAYLOAD_HEADER.size:
+        raise ValueError("Truncated header")
+    magic, version, slot_count, string_count = (
+        _GUID_PAYLOAD_HEADER.unpack_from(payload)
+    )
+    if magic != _GUID_PAYLOAD_MAGIC or version != _GUID_PAYLOAD_VERSION:
+        raise ValueError("Unknown format")
+
+    # `_guid_payload_slot` requires a power of two
+    if not slot_count or slot_count & (slot_count - 1):
+        raise ValueError(f"Invalid slot count: {slot_count}")
+
+    slots_offset = _GUID_PAYLOAD_HEADER.size
+    string_offsets_offset = slots_offset + (
+        slot_count * _GUID_PAYLOAD_SLOT.size
+    )
+    strings_offset = string_offsets_offset + (string_count + 1) * 4
+    if strings_offset > len(payload):
+        raise ValueError("Truncated tables")
+
+    # The last string offset is the size of the strings, which end the file
+    strings_size = struct.unpack_from(
+        "<I",
+        payload,
+        string_offsets_offset + string_count * 4,
+    )[0]
+    if strings_offset + strings_size != len(payload):
+        raise ValueError("Truncated strings")
+
+    def string(index):
+        if not 0 <= index < string_count:
+            raise ValueError(f"Invalid string index: {index}")
+        start, end = struct.unpack_from(
+            "<II",
+            payload,
+            string_offsets_offset + index * 4,
+        )
+        if not start <= end <= strings_size:
+            raise ValueError(f"Invalid string offsets: {start}, {end}")
+        return payload[
+            strings_offset + start:strings_offset + end
+        ].decode("utf-8")
+
+    def decode_slot(guid, label_index, target_ids_index):
+        guid_labels[guid] = string(label_index)
+        guid_target_ids[guid] = _map_target_ids(
+            json.loads(string(target_ids_index)),
+            string,
+        )
+
+    guid_labels = {}
+    guid_target_ids = {}
+
+    if guids is None:
+        for slot in range(slot_count):
+            guid_index, label_index, target_ids_index = (
+                _GUID_PAYLOAD_SLOT.unpack_from(
+                    payload,
+                    slots_offset + slot * _GUID_PAYLOAD_SLOT.size,
+                )
+            )
+            if guid_index:
+                decode_slot(
+                    string(guid_index - 1),
+                    label_index,
+                    target_ids_index,
+                )
+        return guid_labels, guid_target_ids
+
+    for guid in guids:
+        encoded_guid = guid.encode("utf-8")
+        slot = _guid_payload_slot(encoded_guid, slot_count)
+        # At most half of the slots are used, so a table without empty slots
+        # is corrupt, and we stop probing after visiting every slot
+        for _ in range(slot_count):
+            guid_index, label_index, target_ids_index = (
+                _GUID_PAYLOAD_SLOT.unpack_from(
+                    payload,
+                    slots_offset + slot * _GUID_PAYLOAD_SLOT.size,
+                )
+            )
+            if not guid_index:
+                # Not in the payload (e.g. `BazelDependency`)
+                break
+            if string(guid_index - 1) == guid:
+                decode_slot(guid, label_index, target_ids_index)
+                break
+            slot = (slot + 1) % slot_count
+        else:
+            raise ValueError("No empty slots")
 
     return guid_labels, guid_target_ids
 
 
+def _guid_payload_slot(encoded_guid, slot_count):
+    # `slot_count` is a power of two
+    return zlib.crc32(encoded_guid) & (slot_count - 1)
+
+
+def _atomic_json_dump(value, path):
+    # Multiple builds (e.g. a normal build and Index Build) can race to write
+    # this, so we write to a temporary file and rename it into place
+    temp_path = _temp_path(path)
+    with open(temp_path, "w", encoding = "utf-8") as f:
+        json.dump(value, f)
+    os.replace(temp_path, path)
+
+
+def _temp_path(path):
+    # The daemon writes payloads from more than one thread
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
 def _platform_from_build_key(key):
     if key.startswith("BAZEL_TARGET_ID[sdk="):
         return key[20:-2]
@@ -334,9 +1166,16 @@ def _platform_from_compile_key(key):
     return ""
 
 
-def _select_target_ids(target_ids, platform):
-    key = target_ids["key"]
+def _select_resolved_target_ids(resolved_target_ids, platform):
+    target_ids = resolved_target_ids["platforms"].get(platform)
+    if target_ids is None:
+        target_ids = resolved_target_ids[_platform_family(platform)]
+    # Will only be `None` if the target doesn't have any target ids for the
+    # configuration
+    return target_ids or []
 
+
+def _select_target_ids(target_ids, platform):
     platforms = {platform: None}
 
     # We need to try other similar platforms (i.e. other simulator platforms if
@@ -345,21 +1184,296 @@ def _select_target_ids(target_ids, platform):
     # `platform` will be checked first.
     platforms.update(_similar_platforms(platform))
 
+    return _first_platform_target_ids(target_ids, platforms)
+
+
+def _first_platform_target_ids(target_ids, platforms):
+    key = target_ids["key"]
     for platform in platforms:
         platform_target_ids = target_ids.get(platform)
         if platform_target_ids:
             if platform_target_ids == f"$({key})":
-                return target_ids[""]
+                return target_ids.get("")
             return platform_target_ids
-    return target_ids[""]
+    return target_ids.get("")
 
 
 def _similar_platforms(platform):
-    if platform == "macosx" or "simulator" in platform:
+    if _platform_family(platform) == "simulator":
         return _SIMULATOR_PLATFORMS
     return _DEVICE_PLATFORMS
 
 
+def _platform_family(platform):
+    if platform == "macosx" or "simulator" in platform:
+        return "simulator"
+    return "device"
+
+
+def _calculate_output_groups(
+        build_request,
+        guid_labels,
+        guid_target_ids,
+        prefixes):
+    labels_and_target_ids = _calculate_label_and_target_ids(
+        build_request,
+        guid_labels,
+        guid_target_ids,
+    )
+
+    # Schemes can contain the same target multiple times, and multiple GUIDs
+    # can map to the same target id. Duplicate output groups only make Bazel's
+    # command line longer, so we remove them, keeping the first occurrence.
+    unique_labels_and_target_ids = list(dict.fromkeys(labels_and_target_ids))
+    duplicates = len(labels_and_target_ids) - len(unique_labels_and_target_ids)
+    if duplicates:
+        _TRACER.count("duplicate_output_groups", duplicates * len(prefixes))
+        print(
+            f"""\
+note: Removed {duplicates * len(prefixes)} duplicate output groups""",
+            file = sys.stderr,
+        )
+
+    return "\n".join(
+        [
+            f"{label}\n{prefix} {id}"
+            for label, id in unique_labels_and_target_ids
+            for prefix in prefixes
+        ],
+    )
+
+
+class _ThreadStderr:
+    """A `sys.stderr` that writes to a stream chosen per thread.
+
+    `contextlib.redirect_stderr` swaps the process-wide `sys.stderr`, which
+    would mix the output of the daemon's threads. This is installed as
+    `sys.stderr` while any thread has redirected it with `_redirected_stderr`.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.streams = {}
+
+    def write(self, string):
+        return self._stream().write(string)
+
+    def flush(self):
+        self._stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
+
+    def _stream(self):
+        return self.streams.get(threading.get_ident(), self.default)
+
+
+# Guards installing and removing `_ThreadStderr`, and its `streams`
+_STDERR_REDIRECT_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def _redirected_stderr(stream):
+    """Redirects `sys.stderr` to `stream` for the current thread only."""
+    thread = threading.get_ident()
+    with _STDERR_REDIRECT_LOCK:
+        if not isinstance(sys.stderr, _ThreadStderr):
+            sys.stderr = _ThreadStderr(sys.stderr)
+        thread_stderr = sys.stderr
+        previous = thread_stderr.streams.get(thread)
+        thread_stderr.streams[thread] = stream
+    try:
+        yield
+    finally:
+        with _STDERR_REDIRECT_LOCK:
+            if previous is None:
+                del thread_stderr.streams[thread]
+            else:
+                thread_stderr.streams[thread] = previous
+            if not thread_stderr.streams and sys.stderr is thread_stderr:
+                sys.stderr = thread_stderr.default
+
+
+def _daemon_socket_path(base_objroot):
+    # Unix domain socket paths are limited to 104 bytes on macOS, which
+    # `base_objroot` can easily exceed, so we use a hash of it instead. The
+    # script's modification time is included so that a daemon running an
+    # outdated version of this script is never used.
+    key = f"{base_objroot}\0{os.stat(__file__).st_mtime_ns}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(
+        tempfile.gettempdir(),
+        f"rules_xcodeproj_output_groups_{digest}.sock",
+    )
+
+
+def _query_daemon(base_objroot, request):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(_DAEMON_QUERY_TIMEOUT)
+            client.connect(_daemon_socket_path(base_objroot))
+            client.sendall(json.dumps(request).encode("utf-8"))
+            client.shutdown(socket.SHUT_WR)
+            response = _recv_all(client)
+        return json.loads(response)
+    except (OSError, ValueError):
+        # Not running, or it went away mid-query
+        return None
+
+
+def _recv_all(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _serve(base_objroot):
+    socket_path = _daemon_socket_path(base_objroot)
+
+    # The daemon holding this lock owns `socket_path`, so a daemon that is
+    # slow to answer never has its socket replaced, and only the daemon that
+    # bound a socket removes it. The lock is released when the process exits,
+    # even if it didn't shut down cleanly.
+    lock_fd = os.open(f"{socket_path}.lock", os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        # Another daemon is already serving this project
+        os.close(lock_fd)
+        return
+
+    try:
+        _serve_locked(base_objroot, socket_path)
+    finally:
+        os.close(lock_fd)
+
+
+def _serve_locked(base_objroot, socket_path):
+    try:
+        # Left over from a daemon that didn't shut down cleanly
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    server.settimeout(_DAEMON_IDLE_TIMEOUT)
+
+    # The full payload of the newest project PIF, once it has been loaded
+    lock = threading.Lock()
+    payloads = {}
+
+    def load_payload(project_pif, guids):
+        with lock:
+            payload = payloads.get(project_pif)
+        if payload is not None:
+            return payload
+
+        # Not loaded yet, so only resolve the GUIDs in the build request, the
+        # same as when running in-process. `warm_payloads` loads the rest.
+        return _calculate_guid_labels_and_target_ids(
+            base_objroot,
+            guids = guids,
+            complete_in_background = False,
+        )
+
+    stopped = threading.Event()
+
+    def warm_payloads():
+        # Loads the full payload of each new project PIF in the background, so
+        # later queries only need to look it up
+        project_cache = f"{base_objroot}/XCBuildData/PIFCache/project"
+        watcher = _DirectoryWatcher()
+        while not stopped.is_set():
+            try:
+                project_pif = _newest_project_pif(base_objroot)
+                with lock:
+                    loaded = project_pif in payloads
+                if not loaded:
+                    with _redirected_stderr(io.StringIO()):
+                        payload = _calculate_guid_labels_and_target_ids(
+                            base_objroot,
+                        )
+                    with lock:
+                        payloads.clear()
+                        payloads[project_pif] = payload
+            except BaseException:
+                # Queries will report the error
+                pass
+            watcher.wait([project_cache])
+
+    threading.Thread(target = warm_payloads, daemon = True).start()
+
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                break
+            with connection:
+                try:
+                    request = json.loads(_recv_all(connection))
+                    response = _handle_daemon_request(request, load_payload)
+                    connection.sendall(json.dumps(response).encode("utf-8"))
+                except (OSError, ValueError):
+                    # The client went away or sent garbage, in which case it
+                    # falls back to computing in-process
+                    continue
+    finally:
+        stopped.set()
+        server.close()
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def _handle_daemon_request(request, load_payload):
+    stderr = io.StringIO()
+    output = ""
+    exit_code = 0
+    try:
+        # Errors are reported by printing to stderr and exiting, the same as
+        # when running in-process, so we capture both for the client
+        with _redirected_stderr(stderr):
+            build_request = _load_build_request(request["build_request"])
+            guid_labels, guid_target_ids = load_payload(
+                _newest_project_pif(request["base_objroot"]),
+                [
+                    target["guid"]
+                    for target in build_request["configuredTargets"]
+                ],
+            )
+            output = _calculate_output_groups(
+                build_request,
+                guid_labels,
+                guid_target_ids,
+                request["prefixes"],
+            )
+    except SystemExit as error:
+        exit_code = error.code if isinstance(error.code, int) else 1
+    except Exception:
+        print(
+            f"""\
+error: Failed to calculate labels and target ids from PIFCache:
+{traceback.format_exc()}
+Please file a bug report here: \
+https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md""",
+            file = stderr,
+        )
+        exit_code = 1
+
+    return {
+        "output": output,
+        "stderr": stderr.getvalue(),
+        "exit_code": exit_code,
+    }
+
+
 def _main(
         xcode_version,
         objroot,
@@ -369,6 +1483,32 @@ def _main(
     if not os.path.exists(marker_file):
         return
 
+    _TRACER.enabled = (
+        os.getenv("RULES_XCODEPROJ_OUTPUT_GROUPS_TRACE") == "YES"
+    )
+    try:
+        with _TRACER.span("main"):
+            _print_output_groups(
+                xcode_version,
+                objroot,
+                base_objroot,
+                marker_file,
+                prefixes_str,
+            )
+    finally:
+        if _TRACER.enabled:
+            _TRACER.write(
+                f"""\
+{objroot}/rules_xcodeproj_logs/calculate_output_groups.trace.json""",
+            )
+
+
+def _print_output_groups(
+        xcode_version,
+        objroot,
+        base_objroot,
+        marker_file,
+        prefixes_str):
     build_request_min_ctime = os.path.getctime(marker_file)
 
     try:
@@ -385,15 +1525,48 @@ https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bu
 
     prefixes = prefixes_str.split(",")
 
+    use_daemon = os.getenv("RULES_XCODEPROJ_OUTPUT_GROUPS_DAEMON") == "YES"
+
     try:
-        build_request = _get_build_request(
-            xcode_version,
-            objroot,
-            build_request_min_ctime,
-        )
-        guid_labels, guid_target_ids = (
-            _calculate_guid_labels_and_target_ids(base_objroot)
-        )
+        with _TRACER.span("wait_for_build_request"):
+            build_request_path = _get_build_request_path(
+                xcode_version,
+                objroot,
+                build_request_min_ctime,
+            )
+
+        if use_daemon:
+            with _TRACER.span("query_daemon"):
+                response = _query_daemon(
+                    base_objroot,
+                    {
+                        "build_request": build_request_path,
+                        "base_objroot": base_objroot,
+                        "prefixes": prefixes,
+                    },
+                )
+            _TRACER.count("daemon_hits" if response else "daemon_misses")
+            if response:
+                print(response["stderr"], end = "", file = sys.stderr)
+                if response["output"]:
+                    print(response["output"])
+                sys.exit(response["exit_code"])
+
+            # Not running, so compute in-process, and start it for next time
+            _run_in_background("--serve", base_objroot)
+
+        with _TRACER.span("load_build_request"):
+            build_request = _load_build_request(build_request_path)
+        with _TRACER.span("calculate_guid_labels_and_target_ids"):
+            guid_labels, guid_target_ids = (
+                _calculate_guid_labels_and_target_ids(
+                    base_objroot,
+                    guids = [
+                        target["guid"]
+                        for target in build_request["configuredTargets"]
+                    ],
+                )
+            )
     except Exception:
         print(
             f"""\
@@ -405,22 +1578,28 @@ https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bu
         )
         sys.exit(1)
 
-    labels_and_target_ids = _calculate_label_and_target_ids(
-        build_request,
-        guid_labels,
-        guid_target_ids,
-    )
+    with _TRACER.span("calculate_output_groups"):
+        output_groups = _calculate_output_groups(
+            build_request,
+            guid_labels,
+            guid_target_ids,
+            prefixes,
+        )
+    print(output_groups)
 
-    print("\n".join(
-        [
-            f"{label}\n{prefix} {id}"
-            for label, id in labels_and_target_ids
-            for prefix in prefixes
-        ],
-    ))
+
+def _complete_guid_payload(base_objroot):
+    _calculate_guid_labels_and_target_ids(base_objroot)
 
 
 if __name__ == "__main__":
+    if sys.argv[1] == "--complete_guid_payload":
+        _complete_guid_payload(sys.argv[2])
+        sys.exit(0)
+    if sys.argv[1] == "--serve":
+        _serve(sys.argv[2])
+        sys.exit(0)
+
     _main(
         # XCODE_VERSION_ACTUAL
         sys.argv[1],
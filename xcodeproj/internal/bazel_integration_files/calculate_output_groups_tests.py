@@ -0,0 +1,922 @@
+"""Tests for calculate_output_groups."""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from xcodeproj.internal.bazel_integration_files import calculate_output_groups
+
+class calculate_output_groups_test(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.tmp = self._temp_dir.name
+
+    def tearDown(self):
+        # Daemons leave their lock file next to their socket
+        socket_path = calculate_output_groups._daemon_socket_path(self.tmp)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f"{socket_path}.lock")
+        self._temp_dir.cleanup()
+
+    def _write_target_pif(self, name, guid, label, build_settings):
+        target_cache = os.path.join(self.tmp, "XCBuildData/PIFCache/target")
+        os.makedirs(target_cache, exist_ok = True)
+        build_settings = dict(build_settings)
+        if label:
+            build_settings["BAZEL_LABEL"] = label
+        with open(
+            os.path.join(target_cache, f"{name}-json"),
+            "w",
+            encoding = "utf-8",
+        ) as f:
+            json.dump(
+                {
+                    "guid": guid,
+                    "buildConfigurations": [
+                        {"name": "Debug", "buildSettings": build_settings},
+                        {"name": "Release", "buildSettings": build_settings},
+                    ],
+                },
+                f,
+            )
+
+    def _write_project_pif(self, name, target_names):
+        project_cache = os.path.join(self.tmp, "XCBuildData/PIFCache/project")
+        os.makedirs(project_cache, exist_ok = True)
+        for existing in os.listdir(project_cache):
+            os.remove(os.path.join(project_cache, existing))
+        with open(
+            os.path.join(project_cache, name),
+            "w",
+            encoding = "utf-8",
+        ) as f:
+            json.dump({"targets": target_names}, f)
+
+    def _write_pif_cache(self, count):
+        target_names = []
+        for i in range(count):
+            name = f"TARGET@v11_hash={i}"
+            self._write_target_pif(
+                name,
+                guid = f"guid{i}",
+                label = f"//:t{i}",
+                build_settings = {
+                    "BAZEL_TARGET_ID": f"//:t{i} config",
+                    "BAZEL_TARGET_ID[sdk=iphonesimulator*]": (
+                        "$(BAZEL_TARGET_ID)"
+                    ),
+                    "BAZEL_COMPILE_TARGET_IDS": (
+                        f"//:t{i} config //:d{i} config"
+                    ),
+                },
+            )
+            target_names.append(name)
+        self._write_target_pif(
+            "TARGET@v11_hash=deps",
+            guid = "bazel_dependencies",
+            label = None,
+            build_settings = {},
+        )
+        target_names.append("TARGET@v11_hash=deps")
+        self._write_project_pif("PROJECT@v11_hash=a", target_names)
+        return target_names
+
+    def test_wait_for_value_returns_immediately(self):
+        self.assertEqual(
+            calculate_output_groups._wait_for_value(
+                lambda: "value",
+                "value",
+                lambda: [self.tmp],
+            ),
+            "value",
+        )
+
+    def test_wait_for_value_wakes_up_on_new_entry(self):
+        path = os.path.join(self.tmp, "build-request.json")
+
+        def calculate_value():
+            if os.path.exists(path):
+                return path
+            return None
+
+        def create_file():
+            time.sleep(0.05)
+            with open(path, "w", encoding = "utf-8") as f:
+                f.write("{}")
+
+        thread = threading.Thread(target = create_file)
+        thread.start()
+        start = time.monotonic()
+        value = calculate_output_groups._wait_for_value(
+            calculate_value,
+            "build-request.json",
+            lambda: [self.tmp],
+        )
+        waited = time.monotonic() - start
+        thread.join()
+
+        self.assertEqual(value, path)
+        # The old implementation slept in one second increments
+        self.assertLess(waited, 0.5)
+
+    def test_get_build_request(self):
+        xcbuilddata = os.path.join(
+            self.tmp,
+            "XCBuildData",
+            "abc.xcbuilddata",
+        )
+        os.makedirs(xcbuilddata)
+        with open(
+            os.path.join(xcbuilddata, "build-request.json"),
+            "w",
+            encoding = "utf-8",
+        ) as f:
+            f.write('{"configuredTargets": []}')
+
+        build_request_path = calculate_output_groups._get_build_request_path(
+            xcode_version = 1500,
+            objroot = self.tmp,
+            build_request_min_ctime = 0,
+        )
+        self.assertEqual(
+            build_request_path,
+            os.path.join(xcbuilddata, "build-request.json"),
+        )
+        self.assertEqual(
+            calculate_output_groups._load_build_request(build_request_path),
+            {"configuredTargets": []},
+        )
+
+    def test_calculate_guid_labels_and_target_ids(self):
+        self._write_pif_cache(2)
+
+        guid_labels, guid_target_ids = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+
+        self.assertEqual(guid_labels, {"guid0": "//:t0", "guid1": "//:t1"})
+        build_target_ids = {
+            "platforms": {},
+            "device": ["//:t1 config"],
+            "simulator": ["//:t1 config"],
+        }
+        compile_target_ids = {
+            "platforms": {},
+            "device": ["//:t1 config", "//:d1 config"],
+            "simulator": ["//:t1 config", "//:d1 config"],
+        }
+        self.assertEqual(
+            guid_target_ids["guid1"],
+            {
+                "build": {
+                    "Debug": build_target_ids,
+                    "Release": build_target_ids,
+                },
+                "buildFiles": {
+                    "Debug": compile_target_ids,
+                    "Release": compile_target_ids,
+                },
+            },
+        )
+
+    def test_target_payloads_are_reused(self):
+        target_names = self._write_pif_cache(3)
+        expected = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+
+        # Adding a target only parses the new target PIF
+        self._write_target_pif(
+            "TARGET@v11_hash=new",
+            guid = "new",
+            label = "//:new",
+            build_settings = {"BAZEL_TARGET_ID": "//:new config"},
+        )
+        self._write_project_pif(
+            "PROJECT@v11_hash=b",
+            target_names + ["TARGET@v11_hash=new"],
+        )
+
+        with mock.patch.object(
+            calculate_output_groups,
+            "_parse_target_pif",
+            wraps = calculate_output_groups._parse_target_pif,
+        ) as parse_target_pif:
+            guid_labels, guid_target_ids = (
+                calculate_output_groups._calculate_guid_labels_and_target_ids(
+                    self.tmp,
+                )
+            )
+
+        parse_target_pif.assert_called_once()
+        self.assertEqual(guid_labels, {**expected[0], "new": "//:new"})
+        self.assertEqual(
+            {
+                guid: target_ids
+                for guid, target_ids in guid_target_ids.items()
+                if guid != "new"
+            },
+            expected[1],
+        )
+
+    def test_parallel_parsing_matches_serial(self):
+        target_names = self._write_pif_cache(20)
+        target_files = [
+            os.path.join(
+                self.tmp,
+                "XCBuildData/PIFCache/target",
+                f"{target_name}-json",
+            )
+            for target_name in target_names
+        ]
+
+        serial = calculate_output_groups._parse_target_pifs(target_files)
+        with mock.patch.multiple(
+            calculate_output_groups,
+            _PARALLEL_PARSE_THRESHOLD = 0,
+            _PARALLEL_PARSE_MIN_SHARD_SIZE = 3,
+        ), mock.patch.object(os, "cpu_count", return_value = 4):
+            parallel = calculate_output_groups._parse_target_pifs(target_files)
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(serial[-1], ("bazel_dependencies", None, None))
+
+    def test_lazy_resolution_only_parses_requested_targets(self):
+        self._write_pif_cache(10)
+
+        with mock.patch.multiple(
+            calculate_output_groups,
+            _LAZY_RESOLUTION_THRESHOLD = 0,
+            _complete_guid_payload_in_background = mock.DEFAULT,
+        ) as mocks, mock.patch.object(
+            calculate_output_groups,
+            "_target_payload",
+            wraps = calculate_output_groups._target_payload,
+        ) as target_payload:
+            guid_labels, guid_target_ids = (
+                calculate_output_groups._calculate_guid_labels_and_target_ids(
+                    self.tmp,
+                    guids = ["guid3", "guid7", "bazel_dependencies"],
+                )
+            )
+
+        self.assertEqual(target_payload.call_count, 3)
+        mocks["_complete_guid_payload_in_background"].assert_called_once_with(
+            self.tmp,
+        )
+        self.assertEqual(guid_labels, {"guid3": "//:t3", "guid7": "//:t7"})
+
+        # The completed payload agrees with what was lazily resolved
+        full_guid_labels, full_guid_target_ids = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+        self.assertEqual(len(full_guid_labels), 10)
+        self.assertEqual(
+            guid_target_ids,
+            {
+                guid: full_guid_target_ids[guid]
+                for guid in ["guid3", "guid7"]
+            },
+        )
+
+    def test_complete_guid_payload_in_background_runs_once(self):
+        with mock.patch.object(
+            calculate_output_groups.subprocess,
+            "Popen",
+        ) as popen:
+            calculate_output_groups._complete_guid_payload_in_background(
+                self.tmp,
+            )
+            self.assertEqual(popen.call_count, 1)
+            self.assertEqual(len(popen.call_args.kwargs["pass_fds"]), 1)
+
+            # While a background process holds the lock, no other is started
+            lock_path = os.path.join(self.tmp, "guid_payload", "complete.lock")
+            with open(lock_path, "w") as lock:
+                calculate_output_groups.fcntl.flock(
+                    lock,
+                    calculate_output_groups.fcntl.LOCK_EX,
+                )
+                calculate_output_groups._complete_guid_payload_in_background(
+                    self.tmp,
+                )
+                self.assertEqual(popen.call_count, 1)
+
+            calculate_output_groups._complete_guid_payload_in_background(
+                self.tmp,
+            )
+            self.assertEqual(popen.call_count, 2)
+
+    def test_guid_payload_round_trip(self):
+        self._write_pif_cache(20)
+        guid_labels, guid_target_ids = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+        path = os.path.join(self.tmp, "payload.bin")
+        calculate_output_groups._write_guid_payload(
+            path,
+            guid_labels,
+            guid_target_ids,
+        )
+
+        self.assertEqual(
+            calculate_output_groups._read_guid_payload(path, None),
+            (guid_labels, guid_target_ids),
+        )
+        self.assertEqual(
+            calculate_output_groups._read_guid_payload(
+                path,
+                ["guid4", "guid13", "bazel_dependencies", "unknown"],
+            ),
+            (
+                {"guid4": "//:t4", "guid13": "//:t13"},
+                {
+                    "guid4": guid_target_ids["guid4"],
+                    "guid13": guid_target_ids["guid13"],
+                },
+            ),
+        )
+
+    def test_guid_payload_version_mismatch_regenerates(self):
+        self._write_pif_cache(2)
+        expected = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+
+        payload_path = os.path.join(
+            self.tmp,
+            "guid_payload",
+            "PROJECT@v11_hash=a.bin",
+        )
+        with open(payload_path, "r+b") as f:
+            f.write(
+                calculate_output_groups._GUID_PAYLOAD_HEADER.pack(
+                    calculate_output_groups._GUID_PAYLOAD_MAGIC,
+                    calculate_output_groups._GUID_PAYLOAD_VERSION + 1,
+                    0,
+                    0,
+                ),
+            )
+        self.assertIsNone(
+            calculate_output_groups._read_guid_payload(payload_path, None),
+        )
+
+        self.assertEqual(
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            ),
+            expected,
+        )
+        self.assertEqual(
+            calculate_output_groups._read_guid_payload(payload_path, None),
+            expected,
+        )
+
+    def test_corrupt_guid_payload_regenerates(self):
+        self._write_pif_cache(20)
+        expected = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+
+        payload_path = os.path.join(
+            self.tmp,
+            "guid_payload",
+            "PROJECT@v11_hash=a.bin",
+        )
+        with open(payload_path, "rb") as f:
+            payload = f.read()
+        header_size = calculate_output_groups._GUID_PAYLOAD_HEADER.size
+        _, _, slot_count, string_count = (
+            calculate_output_groups._GUID_PAYLOAD_HEADER.unpack_from(payload)
+        )
+        string_offsets_offset = header_size + (
+            slot_count * calculate_output_groups._GUID_PAYLOAD_SLOT.size
+        )
+
+        corruptions = {
+            "truncated header": payload[:header_size - 1],
+            "truncated strings": payload[:-1],
+            "truncated tables": payload[:string_offsets_offset],
+            "invalid slot count": (
+                calculate_output_groups._GUID_PAYLOAD_HEADER.pack(
+                    calculate_output_groups._GUID_PAYLOAD_MAGIC,
+                    calculate_output_groups._GUID_PAYLOAD_VERSION,
+                    slot_count - 1,
+                    string_count,
+                ) + payload[header_size:]
+            ),
+            "invalid string index": (
+                payload[:header_size] +
+                calculate_output_groups._GUID_PAYLOAD_SLOT.pack(
+                    string_count + 1,
+                    string_count,
+                    string_count,
+                ) * slot_count +
+                payload[string_offsets_offset:]
+            ),
+            "invalid string offsets": (
+                payload[:string_offsets_offset] +
+                struct.pack("<I", len(payload)) * string_count +
+                payload[string_offsets_offset + string_count * 4:]
+            ),
+            "no empty slots": (
+                payload[:header_size] +
+                calculate_output_groups._GUID_PAYLOAD_SLOT.pack(1, 0, 0) *
+                slot_count +
+                payload[string_offsets_offset:]
+            ),
+        }
+        for name, corrupt_payload in corruptions.items():
+            with self.subTest(name):
+                with open(payload_path, "wb") as f:
+                    f.write(corrupt_payload)
+                self.assertIsNone(
+                    calculate_output_groups._read_guid_payload(
+                        payload_path,
+                        ["guid4", "unknown"],
+                    ),
+                )
+
+                self.assertEqual(
+                    calculate_output_groups._calculate_guid_labels_and_target_ids(
+                        self.tmp,
+                    ),
+                    expected,
+                )
+                self.assertEqual(
+                    calculate_output_groups._read_guid_payload(
+                        payload_path,
+                        None,
+                    ),
+                    expected,
+                )
+
+    def _write_build_request(self, path, guids):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "w", encoding = "utf-8") as f:
+            json.dump(
+                {
+                    "parameters": {
+                        "activeRunDestination": {
+                            "platform": "iphonesimulator",
+                        },
+                        "configurationName": "Debug",
+                    },
+                    "configuredTargets": [{"guid": guid} for guid in guids],
+                },
+                f,
+            )
+
+    def test_daemon_request_stderr_with_concurrent_redirect(self):
+        build_request_path = os.path.join(self.tmp, "build-request.json")
+        self._write_build_request(build_request_path, ["guid0"])
+
+        original_stderr = sys.stderr
+
+        # Simulates the PIFCache watcher redirecting stderr while a query runs
+        redirected = threading.Event()
+        def _watch():
+            with calculate_output_groups._redirected_stderr(io.StringIO()):
+                redirected.set()
+                time.sleep(0.2)
+        watcher = threading.Thread(target = _watch)
+        watcher.start()
+        redirected.wait()
+
+        def _load_payload(project_pif, guids):
+            time.sleep(0.3)
+            print("error: Failed to load payload", file = sys.stderr)
+            sys.exit(1)
+
+        with mock.patch.object(
+            calculate_output_groups,
+            "_newest_project_pif",
+            return_value = None,
+        ):
+            response = calculate_output_groups._handle_daemon_request(
+                {
+                    "build_request": build_request_path,
+                    "base_objroot": self.tmp,
+                    "prefixes": ["bp"],
+                },
+                _load_payload,
+            )
+        watcher.join()
+
+        self.assertEqual(response["exit_code"], 1)
+        self.assertEqual(response["stderr"], "error: Failed to load payload\n")
+        self.assertIs(sys.stderr, original_stderr)
+
+    def test_daemon_matches_in_process(self):
+        self._write_pif_cache(3)
+        build_request_path = os.path.join(self.tmp, "build-request.json")
+        self._write_build_request(
+            build_request_path,
+            ["guid2", "bazel_dependencies", "guid0"],
+        )
+        request = {
+            "build_request": build_request_path,
+            "base_objroot": self.tmp,
+            "prefixes": ["bp", "bc"],
+        }
+
+        self.assertIsNone(
+            calculate_output_groups._query_daemon(self.tmp, request),
+        )
+
+        # A cold daemon answers with lazy resolution, without waiting for the
+        # full payload it loads in the background
+        answered = threading.Event()
+        parse_target_pifs = calculate_output_groups._parse_target_pifs
+        def _blocked_parse_target_pifs(target_files):
+            answered.wait(5)
+            return parse_target_pifs(target_files)
+
+        with mock.patch.object(
+            calculate_output_groups,
+            "_DAEMON_IDLE_TIMEOUT",
+            0.5,
+        ), mock.patch.object(
+            calculate_output_groups,
+            "_LAZY_RESOLUTION_THRESHOLD",
+            0,
+        ), mock.patch.object(
+            calculate_output_groups,
+            "_parse_target_pifs",
+            side_effect = _blocked_parse_target_pifs,
+        ), mock.patch.object(
+            calculate_output_groups,
+            "_complete_guid_payload_in_background",
+            side_effect = AssertionError("completed out of process"),
+        ):
+            server = threading.Thread(
+                target = calculate_output_groups._serve,
+                args = (self.tmp,),
+            )
+            server.start()
+            try:
+                response = None
+                for _ in range(100):
+                    response = calculate_output_groups._query_daemon(
+                        self.tmp,
+                        request,
+                    )
+                    if response:
+                        break
+                    time.sleep(0.01)
+            finally:
+                answered.set()
+                server.join()
+
+        guid_labels, guid_target_ids = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+        self.assertEqual(response["exit_code"], 0)
+        self.assertEqual(
+            response["output"],
+            calculate_output_groups._calculate_output_groups(
+                calculate_output_groups._load_build_request(
+                    build_request_path,
+                ),
+                guid_labels,
+                guid_target_ids,
+                ["bp", "bc"],
+            ),
+        )
+        self.assertEqual(
+            response["output"].splitlines(),
+            [
+                "//:t2",
+                "bp //:t2 config",
+                "//:t2",
+                "bc //:t2 config",
+                "//:t0",
+                "bp //:t0 config",
+                "//:t0",
+                "bc //:t0 config",
+            ],
+        )
+
+    def test_serve_owns_its_socket(self):
+        self._write_pif_cache(1)
+        build_request_path = os.path.join(self.tmp, "build-request.json")
+        self._write_build_request(build_request_path, ["guid0"])
+        request = {
+            "build_request": build_request_path,
+            "base_objroot": self.tmp,
+            "prefixes": ["bp"],
+        }
+        socket_path = calculate_output_groups._daemon_socket_path(self.tmp)
+
+        # A socket left over from a daemon that didn't shut down cleanly
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(socket_path)
+
+        with mock.patch.object(
+            calculate_output_groups,
+            "_DAEMON_IDLE_TIMEOUT",
+            0.5,
+        ):
+            server = threading.Thread(
+                target = calculate_output_groups._serve,
+                args = (self.tmp,),
+            )
+            server.start()
+            try:
+                response = None
+                for _ in range(100):
+                    response = calculate_output_groups._query_daemon(
+                        self.tmp,
+                        request,
+                    )
+                    if response:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(response["exit_code"], 0)
+                inode = os.stat(socket_path).st_ino
+
+                # A second daemon leaves the running daemon's socket alone
+                calculate_output_groups._serve(self.tmp)
+                self.assertEqual(os.stat(socket_path).st_ino, inode)
+                self.assertEqual(
+                    calculate_output_groups._query_daemon(self.tmp, request),
+                    response,
+                )
+            finally:
+                server.join()
+
+        self.assertFalse(os.path.exists(socket_path))
+
+    def test_resolved_target_ids_match_select_target_ids(self):
+        all_platforms = (
+            list(calculate_output_groups._DEVICE_PLATFORMS) +
+            list(calculate_output_groups._SIMULATOR_PLATFORMS) +
+            ["xros", "xrsimulator", "driverkit", "unknown"]
+        )
+        inherit = "$(BAZEL_TARGET_ID)"
+        configurations = [
+            {"": ["base"]},
+            {"": ["base"], "iphonesimulator": inherit},
+            {"": ["base"], "iphonesimulator": ["sim"], "iphoneos": ["dev"]},
+            {
+                "": ["base"],
+                "appletvsimulator": ["tvsim"],
+                "watchsimulator": inherit,
+                "macosx": ["mac"],
+            },
+            {"": ["base"], "watchos": ["watch"], "appletvos": []},
+            {"": ["base"], "xros": ["vision"], "xrsimulator": ["visionsim"]},
+            {"iphoneos": ["dev"]},
+            {},
+        ]
+
+        for configuration in configurations:
+            target_ids = {"key": "BAZEL_TARGET_ID", **configuration}
+            resolved_target_ids = (
+                calculate_output_groups._resolve_target_ids(target_ids)
+            )
+            for platform in all_platforms:
+                with self.subTest(
+                    configuration = configuration,
+                    platform = platform,
+                ):
+                    self.assertEqual(
+                        calculate_output_groups._select_resolved_target_ids(
+                            resolved_target_ids,
+                            platform,
+                        ),
+                        calculate_output_groups._select_target_ids(
+                            target_ids,
+                            platform,
+                        ) or [],
+                    )
+
+    def test_trace(self):
+        self._write_pif_cache(3)
+        marker_file = os.path.join(self.tmp, "build_marker")
+        with open(marker_file, "w", encoding = "utf-8"):
+            pass
+        self._write_build_request(
+            os.path.join(
+                self.tmp,
+                "XCBuildData/abc.xcbuilddata/build-request.json",
+            ),
+            ["guid1"],
+        )
+
+        stdout = io.StringIO()
+        with mock.patch.dict(
+            os.environ,
+            {"RULES_XCODEPROJ_OUTPUT_GROUPS_TRACE": "YES"},
+        ), mock.patch.object(
+            calculate_output_groups,
+            "_TRACER",
+            calculate_output_groups._Tracer(),
+        ), contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(
+            io.StringIO(),
+        ):
+            calculate_output_groups._main(
+                "1500",
+                self.tmp,
+                self.tmp,
+                marker_file,
+                "bp",
+            )
+
+        self.assertEqual(stdout.getvalue(), "//:t1\nbp //:t1 config\n")
+
+        with open(
+            os.path.join(
+                self.tmp,
+                "rules_xcodeproj_logs/calculate_output_groups.trace.json",
+            ),
+            encoding = "utf-8",
+        ) as f:
+            trace = json.load(f)
+
+        spans = {
+            event["name"]
+            for event in trace["traceEvents"]
+            if event["ph"] == "X"
+        }
+        self.assertTrue(
+            {
+                "main",
+                "wait_for_build_request",
+                "load_build_request",
+                "read_guid_payload",
+                "load_project_pif",
+                "parse_target_pifs",
+                "write_guid_payload",
+                "calculate_output_groups",
+            }.issubset(spans),
+        )
+        counters = trace["traceEvents"][-1]
+        self.assertEqual(counters["ph"], "C")
+        self.assertEqual(counters["args"]["target_pifs_parsed"], 4)
+        self.assertEqual(counters["args"]["guid_payload_misses"], 1)
+        self.assertGreater(counters["args"]["bytes_read"], 0)
+
+    def test_newest_entry_scanner(self):
+        directory = os.path.join(self.tmp, "XCBuildData")
+        scanner = calculate_output_groups._NewestEntryScanner(
+            directory,
+            lambda name: name.endswith(".xcbuilddata"),
+        )
+
+        self.assertIsNone(scanner.newest())
+
+        os.makedirs(directory)
+        os.mkdir(os.path.join(directory, "PIFCache"))
+        self.assertIsNone(scanner.newest())
+
+        for name in ["a", "b", "c"]:
+            os.mkdir(os.path.join(directory, f"{name}.xcbuilddata"))
+            os.utime(os.path.join(directory, f"{name}.xcbuilddata"))
+            newest, ctime = scanner.newest()
+            self.assertEqual(
+                newest,
+                os.path.join(directory, f"{name}.xcbuilddata"),
+            )
+            self.assertEqual(ctime, os.path.getctime(newest))
+
+        # Xcode reuses existing entries, which makes them the newest
+        with open(
+            os.path.join(directory, "a.xcbuilddata", "build-request.json"),
+            "w",
+        ) as f:
+            f.write("{}")
+        self.assertEqual(
+            scanner.newest()[0],
+            os.path.join(directory, "a.xcbuilddata"),
+        )
+
+        os.rmdir(os.path.join(directory, "c.xcbuilddata"))
+        os.utime(os.path.join(directory, "b.xcbuilddata"))
+        self.assertEqual(
+            scanner.newest()[0],
+            os.path.join(directory, "b.xcbuilddata"),
+        )
+
+    def test_newest_entry_scanner_immutable_entries(self):
+        directory = os.path.join(self.tmp, "project")
+        os.makedirs(directory)
+        scanner = calculate_output_groups._NewestEntryScanner(
+            directory,
+            lambda name: True,
+            immutable_entries = True,
+        )
+
+        for name in ["a", "b"]:
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(name)
+            self.assertEqual(
+                scanner.newest()[0],
+                os.path.join(directory, name),
+            )
+
+        with mock.patch.object(
+            calculate_output_groups,
+            "_SCANNER_MTIME_GRANULARITY",
+            0,
+        ):
+            # The directory isn't read again if it didn't change
+            with mock.patch.object(
+                calculate_output_groups.os,
+                "scandir",
+                side_effect = AssertionError("directory was read again"),
+            ):
+                self.assertEqual(
+                    scanner.newest()[0],
+                    os.path.join(directory, "b"),
+                )
+
+            # Only new entries are stat'd, so changing the ctime of an entry
+            # that was already seen (which Xcode doesn't do for these) doesn't
+            # make it the newest
+            time.sleep(0.01)
+            with open(os.path.join(directory, "c"), "w") as f:
+                f.write("c")
+            time.sleep(0.01)
+            os.chmod(os.path.join(directory, "a"), 0o600)
+            self.assertEqual(
+                scanner.newest()[0],
+                os.path.join(directory, "c"),
+            )
+
+        # A replaced entry is stat'd again
+        time.sleep(0.01)
+        with open(os.path.join(directory, "a.tmp"), "w") as f:
+            f.write("a")
+        os.replace(
+            os.path.join(directory, "a.tmp"),
+            os.path.join(directory, "a"),
+        )
+        self.assertEqual(scanner.newest()[0], os.path.join(directory, "a"))
+
+    def test_output_groups_are_deduplicated(self):
+        self._write_pif_cache(2)
+        build_request_path = os.path.join(self.tmp, "build-request.json")
+        self._write_build_request(
+            build_request_path,
+            ["guid1", "guid0", "guid1", "bazel_dependencies", "guid0"],
+        )
+        build_request = calculate_output_groups._load_build_request(
+            build_request_path,
+        )
+        guid_labels, guid_target_ids = (
+            calculate_output_groups._calculate_guid_labels_and_target_ids(
+                self.tmp,
+            )
+        )
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            output_groups = calculate_output_groups._calculate_output_groups(
+                build_request,
+                guid_labels,
+                guid_target_ids,
+                ["bc", "bp"],
+            )
+
+        self.assertEqual(
+            output_groups.splitlines(),
+            [
+                "//:t1",
+                "bc //:t1 config",
+                "//:t1",
+                "bp //:t1 config",
+                "//:t0",
+                "bc //:t0 config",
+                "//:t0",
+                "bp //:t0 config",
+            ],
+        )
+        self.assertIn("Removed 4 duplicate output groups", stderr.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,33 @@
 #!/usr/bin/python3
 
+import base64
+import codecs
+import contextlib
+import datetime
+import functools
+import gzip
+import io
+import json
 import os
+import queue
 import re
+import selectors
 import subprocess
+import stat
 import sys
-from typing import List
+import threading
+import time
+import urllib.parse
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+)
 import signal
 
 
@@ -12,18 +35,849 @@ STRIP_COLOR_RE = re.compile(r"\x1b\[[0-9;]{1,}[A-Za-z]")
 RELATIVE_DIAGNOSTICS_RE = re.compile(
     r"""
     ^
-    (?P<loc>.+?:\d+(?::\d+)?:\s)  # Capture location (e.g. "foo/bar:12:3: ")
+    (?P<loc>(?P<path>.+?)         # Capture location (e.g. "foo/bar:12:3: ")
+      :(?P<line>\d+)              #   and its path, line,
+      (?::(?P<column>\d+))?:\s)   #   and optional column
     (?:fatal\s)?                  # Dropping "fatal "
-    (?P<sev>(?:error|warning):\s) # Capture severity
+    (?P<sev>(?P<severity>error|warning):\s) # Capture severity
     (?P<msg>.*)                   # Capture the rest of the message
     """,
     re.VERBOSE,
 )
 
+# Size of the reads from Bazel's stderr
+_READ_CHUNK_SIZE = 64 * 1024
+
+# Lines longer than this many characters are passed through in pieces, without
+# being processed, to keep memory use bounded. Can be overridden with
+# `RULES_XCODEPROJ_MAX_LOG_LINE_LENGTH`.
+_MAX_LINE_LENGTH = 256 * 1024
+
+# Output is written when this many bytes are buffered, or when the oldest
+# buffered line has waited this many seconds, whichever comes first. This keeps
+# Xcode's log view interactive while avoiding a write per line.
+_FLUSH_SIZE = 64 * 1024
+_FLUSH_DELAY = 0.05
+
+# Number of diagnostic paths to remember the resolved form of
+_PATH_CACHE_SIZE = 4096
+
+# Number of the most repeated diagnostics listed when collapsing duplicates
+_DUPLICATE_SUMMARY_LIMIT = 10
+
+# Buffer size of the JSON Lines diagnostics file
+_DIAGNOSTICS_FILE_BUFFER_SIZE = 1024 * 1024
+
+_DIAGNOSTIC_RECORD_ENCODER = json.JSONEncoder(separators = (",", ":"))
+
+# Options that can come before the Bazel command:
+#
+# - `--requested_target_ids=<path>`: A file with the target IDs that are being
+#   built, one per line. If set, a successful build fails if any of them are
+#   missing from `--target_ids_list`.
+# - `--target_ids_list=<path>`: The target IDs list that Bazel builds.
+_OPTIONS = frozenset(("--requested_target_ids", "--target_ids_list"))
+
+# Raw build logs are rotated when a compressed file reaches this size, and the
+# oldest ones are removed when all of them together exceed
+# `RULES_XCODEPROJ_RAW_BUILD_LOG_MAX_SIZE` bytes (which defaults to
+# `_RAW_LOG_MAX_TOTAL_SIZE`)
+_RAW_LOG_MAX_FILE_SIZE = 32 * 1024 * 1024
+_RAW_LOG_MAX_TOTAL_SIZE = 256 * 1024 * 1024
+
+# Raw output waiting to be compressed is dropped past this size, instead of
+# slowing down the processing of the log
+_RAW_LOG_MAX_PENDING_SIZE = 64 * 1024 * 1024
+
+# Bazel output that marks the start of a build phase, in phase order
+_BUILD_PHASE_PREFIXES = (
+    ("loading", ("Loading:", "Computing main repo mapping:")),
+    ("analysis", ("Analyzing:",)),
+    ("execution", ("INFO: Found ", "[")),
+    (
+        "completion",
+        (
+            "INFO: Elapsed time:",
+            "INFO: Build completed",
+            "ERROR: Build did NOT complete",
+        ),
+    ),
+)
+_EXECUTION_PHASE_INDEX = [
+    name for name, _ in _BUILD_PHASE_PREFIXES
+].index("execution")
+_BUILD_TIMELINE_PREFIXES = tuple(
+    prefix
+    for _, prefixes in _BUILD_PHASE_PREFIXES
+    for prefix in prefixes
+    if prefix != "["
+) + ("INFO: ",)
+_BUILD_PROGRESS_RE = re.compile(r"\[([\d,]+) / ([\d,]+)\]")
+_BUILD_ELAPSED_TIME_RE = re.compile(
+    r"INFO: Elapsed time: ([\d.]+)s(?:, Critical Path: ([\d.]+)s)?",
+)
+_BUILD_PROCESSES_RE = re.compile(
+    r"INFO: ([\d,]+) process(?:es)?(?:: (.*?))?\.?$",
+)
+_BUILD_TOTAL_ACTIONS_RE = re.compile(r"([\d,]+) total actions?")
+
+# How often the Build Event Protocol file is checked for new events
+_BUILD_EVENT_POLL_INTERVAL = 0.1
+
+# Maximum number of bytes of a failed action's stderr that are read
+_BUILD_EVENT_MAX_STDERR_SIZE = 4 * 1024 * 1024
+
+# Number of Bazel's most recent output lines that are remembered, so a failed
+# action's stderr isn't repeated when it arrives in a build event after Bazel
+# printed it
+_BUILD_EVENT_DEDUPLICATION_WINDOW = 16 * 1024
+
+
 def _uppercase_first_letter(s: str) -> str:
     return s[:1].upper() + s[1:]
 
-def _main(command: List[str]) -> None:
+
+def _diagnostic_record(
+        match: re.Match,
+        resolved_path: str,
+        message: str) -> str:
+    """Returns the JSON Lines record for a diagnostic."""
+    column = match.group("column")
+    return _DIAGNOSTIC_RECORD_ENCODER.encode(
+        {
+            "file": match.group("path"),
+            "line": int(match.group("line")),
+            "column": int(column) if column else None,
+            "severity": match.group("severity"),
+            "message": message,
+            "path": resolved_path,
+        },
+    ) + "\n"
+
+
+def _open_diagnostics_file(path: str) -> Optional[TextIO]:
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        return open(
+            path,
+            "w",
+            buffering = _DIAGNOSTICS_FILE_BUFFER_SIZE,
+            encoding = "utf-8",
+        )
+    except OSError as e:
+        print(
+            f"warning: Failed to open diagnostics file \"{path}\": {e}",
+            file = sys.stderr,
+        )
+        return None
+
+
+def _add_build_event_json_file_flag(
+        command: List[str],
+        path: str) -> List[str]:
+    """Returns `command` with `--build_event_json_file` set to `path`."""
+    flag = f"--build_event_json_file={path}"
+    try:
+        # Startup options come before the command, so add the flag after it
+        index = command.index("build") + 1
+    except ValueError:
+        index = len(command)
+    return command[:index] + [flag] + command[index:]
+
+
+class _BuildEventReader:
+    """Incrementally reads the events of a JSON Build Event Protocol file.
+
+    The file can be a regular file or a named pipe, and may not exist yet,
+    since Bazel creates it after it starts.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._fd: Optional[int] = None
+        self._partial_line = b""
+
+    def read(self) -> List[Dict[str, Any]]:
+        """Returns the events written since the last call."""
+        if self._fd is None:
+            try:
+                self._fd = os.open(self._path, os.O_RDONLY | os.O_NONBLOCK)
+            except FileNotFoundError:
+                return []
+
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self._fd, _READ_CHUNK_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        if not chunks:
+            return []
+
+        lines = (self._partial_line + b"".join(chunks)).split(b"\n")
+        self._partial_line = lines.pop()
+
+        events = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        return events
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _read_build_event_file(file: Dict[str, Any]) -> str:
+    """Returns the contents of a Build Event Protocol `File` message."""
+    contents = file.get("contents")
+    if contents is not None:
+        data = base64.b64decode(contents)
+    else:
+        uri = file.get("uri", "")
+        if not uri.startswith("file://"):
+            return ""
+        try:
+            with open(urllib.parse.unquote(uri[len("file://"):]), "rb") as f:
+                data = f.read(_BUILD_EVENT_MAX_STDERR_SIZE)
+        except OSError:
+            return ""
+    return data.decode("utf-8", errors = "replace")
+
+
+def _build_event_lines(event: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """Returns the errors and action output to surface for a build event.
+
+    Only failed actions and failed or aborted targets are surfaced. The action
+    output is the failed action's stderr, split into lines.
+    """
+    event_id = event.get("id", {})
+
+    action = event.get("action")
+    if action is not None and not action.get("success", False):
+        action_id = event_id.get("actionCompleted", {})
+        label = action.get("label") or action_id.get("label", "")
+        mnemonic = action.get("type") or "Action"
+        detail = (
+            action.get("failureDetail", {}).get("message") or
+            f"exit code {action.get('exitCode', 'unknown')}"
+        )
+        stderr = action.get("stderr")
+        return (
+            [f"error: {mnemonic} of {label} failed: {detail}"],
+            _read_build_event_file(stderr).splitlines() if stderr else [],
+        )
+
+    target_id = event_id.get("targetCompleted")
+    if target_id is not None:
+        completed = event.get("completed")
+        if completed is not None and completed.get("success", False):
+            return ([], [])
+        aborted = event.get("aborted", {})
+        detail = aborted.get("description") or aborted.get("reason")
+        message = f"error: {target_id.get('label', '')} failed to build"
+        if detail:
+            message += f": {detail}"
+        return ([message], [])
+
+    return ([], [])
+
+
+class _RawLogWriter:
+    """Writes a gzip compressed copy of Bazel's raw output.
+
+    Compression happens on a background thread, so `write()` never waits on
+    it. Logs are written to rotating files in `directory`, and the oldest logs
+    are removed to keep the directory under `max_total_size` bytes.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            max_file_size: int = _RAW_LOG_MAX_FILE_SIZE,
+            max_total_size: int = _RAW_LOG_MAX_TOTAL_SIZE,
+            max_pending_size: int = _RAW_LOG_MAX_PENDING_SIZE) -> None:
+        self._directory = directory
+        self._max_file_size = max_file_size
+        self._max_total_size = max_total_size
+        self._max_pending_size = max_pending_size
+        self._name = datetime.datetime.now().strftime(
+            f"bazel_build_%Y%m%d-%H%M%S_{os.getpid()}",
+        )
+        self._queue: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._pending_size = 0
+        self._dropped_size = 0
+        self._thread = threading.Thread(
+            target = self._run,
+            name = "raw_log_writer",
+            daemon = True,
+        )
+        self._thread.start()
+
+    def write(self, chunk: bytes) -> None:
+        with self._lock:
+            if self._pending_size + len(chunk) > self._max_pending_size:
+                self._dropped_size += len(chunk)
+                return
+            self._pending_size += len(chunk)
+        self._queue.put(chunk)
+
+    def close(self) -> None:
+        """Waits for the buffered output to be written."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        part = 0
+        path = None
+        raw_file = None
+        gzip_file = None
+
+        def _close_part() -> None:
+            nonlocal raw_file, gzip_file
+            if gzip_file is not None:
+                gzip_file.close()
+                gzip_file = None
+            if raw_file is not None:
+                raw_file.close()
+                raw_file = None
+
+        try:
+            os.makedirs(self._directory, exist_ok = True)
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                with self._lock:
+                    self._pending_size -= len(chunk)
+
+                if gzip_file is None:
+                    part += 1
+                    path = os.path.join(
+                        self._directory,
+                        f"{self._name}.{part}.log.gz",
+                    )
+                    raw_file = open(path, "wb")
+                    gzip_file = gzip.GzipFile(
+                        fileobj = raw_file,
+                        mode = "wb",
+                        compresslevel = 1,
+                    )
+                    self._prune(path)
+
+                self._write_dropped_note(gzip_file)
+                gzip_file.write(chunk)
+
+                if raw_file.tell() >= self._max_file_size:
+                    _close_part()
+
+            if gzip_file is not None:
+                self._write_dropped_note(gzip_file)
+        except OSError as e:
+            print(
+                f"""\
+warning: Failed to write raw build log to "{self._directory}": {e}\
+""",
+                file = sys.stderr,
+            )
+        finally:
+            _close_part()
+            if path:
+                self._prune(path)
+
+    def _write_dropped_note(self, gzip_file: gzip.GzipFile) -> None:
+        with self._lock:
+            dropped_size = self._dropped_size
+            self._dropped_size = 0
+        if dropped_size:
+            gzip_file.write(
+                f"""
+[rules_xcodeproj: {dropped_size} bytes of output were dropped, since they \
+couldn't be compressed fast enough]
+""".encode(),
+            )
+
+    def _prune(self, current_path: str) -> None:
+        """Removes the oldest logs until they fit in `max_total_size`."""
+        try:
+            logs = []
+            total_size = 0
+            for entry in os.scandir(self._directory):
+                if not (
+                    entry.name.startswith("bazel_build_") and
+                    entry.name.endswith(".log.gz")
+                ):
+                    continue
+                stat_result = entry.stat()
+                total_size += stat_result.st_size
+                if entry.path != current_path:
+                    logs.append(
+                        (stat_result.st_mtime, entry.path, stat_result.st_size),
+                    )
+        except OSError:
+            return
+
+        for _, path, size in sorted(logs):
+            if total_size <= self._max_total_size:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(path)
+                total_size -= size
+
+
+def _parse_count(count: str) -> int:
+    return int(count.replace(",", ""))
+
+
+class _BuildTimeline:
+    """Records when Bazel's output shows the build moving between phases.
+
+    Also records the critical path and action counts Bazel reports.
+    """
+
+    def __init__(self) -> None:
+        self._start = time.monotonic()
+        self._phases: List[Tuple[str, float]] = []
+        self._next_phase = 0
+        self._last_progress_line = ""
+        self._total_actions: Optional[int] = None
+        self._elapsed_time: Optional[float] = None
+        self._critical_path: Optional[float] = None
+        self._processes: Dict[str, int] = {}
+        self._duration: Optional[float] = None
+
+    def observe(self, line: str) -> None:
+        if line.startswith("\x1b"):
+            line = STRIP_COLOR_RE.sub("", line)
+
+        if line.startswith("["):
+            # Progress lines are most of the output, so they are only parsed
+            # once the build is done
+            self._last_progress_line = line
+            if self._next_phase > _EXECUTION_PHASE_INDEX:
+                return
+        elif not line.startswith(_BUILD_TIMELINE_PREFIXES):
+            return
+
+        for index in range(self._next_phase, len(_BUILD_PHASE_PREFIXES)):
+            name, prefixes = _BUILD_PHASE_PREFIXES[index]
+            if line.startswith(prefixes):
+                self._phases.append((name, time.monotonic() - self._start))
+                self._next_phase = index + 1
+                break
+
+        if not line.startswith("INFO: "):
+            return
+
+        match = _BUILD_ELAPSED_TIME_RE.match(line)
+        if match:
+            self._elapsed_time = float(match.group(1))
+            if match.group(2):
+                self._critical_path = float(match.group(2))
+            return
+
+        match = _BUILD_PROCESSES_RE.match(line)
+        if match:
+            processes = {"total": _parse_count(match.group(1))}
+            for strategy in (match.group(2) or "").split(","):
+                count, _, name = strategy.strip().partition(" ")
+                if name and count.replace(",", "").isdigit():
+                    processes[name] = _parse_count(count)
+            self._processes = processes
+            return
+
+        match = _BUILD_TOTAL_ACTIONS_RE.search(line)
+        if match:
+            self._total_actions = _parse_count(match.group(1))
+
+    def finish(self) -> None:
+        self._duration = time.monotonic() - self._start
+
+    def _action_counts(self) -> Tuple[int, int]:
+        """Returns the number of completed and total actions."""
+        completed = total = 0
+        match = _BUILD_PROGRESS_RE.match(self._last_progress_line)
+        if match:
+            completed = _parse_count(match.group(1))
+            total = _parse_count(match.group(2))
+        if self._total_actions is not None:
+            total = self._total_actions
+        return (completed, total)
+
+    def to_json(self, exit_code: int) -> Dict[str, Any]:
+        duration = self._duration
+        if duration is None:
+            duration = time.monotonic() - self._start
+        completed_actions, total_actions = self._action_counts()
+
+        phases = []
+        for index, (name, start) in enumerate(self._phases):
+            end = (
+                self._phases[index + 1][1]
+                if index + 1 < len(self._phases) else duration
+            )
+            phases.append(
+                {
+                    "name": name,
+                    "start": round(start, 3),
+                    "duration": round(end - start, 3),
+                },
+            )
+
+        return {
+            "duration": round(duration, 3),
+            "exit_code": exit_code,
+            "phases": phases,
+            "elapsed_time": self._elapsed_time,
+            "critical_path": self._critical_path,
+            "actions": {
+                "completed": completed_actions,
+                "total": total_actions,
+            },
+            "processes": self._processes,
+        }
+
+    def summary(self, exit_code: int) -> str:
+        timeline = self.to_json(exit_code)
+        details = [f"total {timeline['duration']:.2f}s"]
+        if self._critical_path is not None:
+            details.append(f"critical path {self._critical_path:.2f}s")
+        if timeline["actions"]["total"]:
+            details.append(f"{timeline['actions']['total']} actions")
+        if self._processes:
+            details.append(f"{self._processes['total']} processes")
+
+        phases = ", ".join(
+            f"{phase['name']} {phase['duration']:.2f}s"
+            for phase in timeline["phases"]
+        )
+        return f"""\
+Bazel build timeline: {phases or "no phases detected"} ({", ".join(details)})\
+"""
+
+    def write(self, path: str, exit_code: int) -> None:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding = "utf-8") as f:
+                json.dump(self.to_json(exit_code), f, indent = 2)
+                f.write("\n")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(
+                f"warning: Failed to write build timeline to \"{path}\": {e}",
+                file = sys.stderr,
+            )
+
+
+def _duplicate_diagnostics_summary(
+        diagnostic_counts: Dict[str, int],
+        limit: int = _DUPLICATE_SUMMARY_LIMIT) -> List[str]:
+    """Returns lines describing the diagnostics that were collapsed."""
+    duplicates = sorted(
+        (
+            (count, diagnostic)
+            for diagnostic, count in diagnostic_counts.items()
+            if count > 1
+        ),
+        key = lambda duplicate: -duplicate[0],
+    )
+    if not duplicates:
+        return []
+
+    suppressed = sum(count - 1 for count, _ in duplicates)
+    lines = [
+        f"""\
+note: Suppressed {suppressed} duplicate diagnostic\
+{"" if suppressed == 1 else "s"}:\
+""",
+    ]
+    lines.extend(
+        f"note:   ({count}x) {diagnostic}"
+        for count, diagnostic in duplicates[:limit]
+    )
+    if len(duplicates) > limit:
+        lines.append(
+            f"note:   ... and {len(duplicates) - limit} more repeated diagnostics",
+        )
+    return lines
+
+
+class _BatchedWriter:
+    """Buffers lines and writes them to `stream` in batches."""
+
+    def __init__(
+            self,
+            stream: TextIO,
+            flush_size: int = _FLUSH_SIZE,
+            flush_delay: float = _FLUSH_DELAY) -> None:
+        self._stream = stream
+        self._flush_size = flush_size
+        self._flush_delay = flush_delay
+        self._buffer: List[str] = []
+        self._size = 0
+        self._deadline = 0.0
+
+    def write_line(self, line: str) -> None:
+        if not self._buffer:
+            self._deadline = time.monotonic() + self._flush_delay
+        self._buffer.append(line)
+        self._buffer.append("\n")
+        self._size += len(line) + 1
+        if self._size >= self._flush_size:
+            self.flush()
+
+    def write(self, text: str) -> None:
+        if not self._buffer:
+            self._deadline = time.monotonic() + self._flush_delay
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self._flush_size:
+            self.flush()
+
+    def timeout(self) -> Optional[float]:
+        """Returns how long until buffered lines need to be written."""
+        if not self._buffer:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def flush_if_due(self) -> None:
+        if self._buffer and time.monotonic() >= self._deadline:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        self._stream.write("".join(self._buffer))
+        self._stream.flush()
+        self._buffer = []
+        self._size = 0
+
+
+class _LineSplitter:
+    """Splits text into lines, without holding onto overly long lines.
+
+    `split()` returns pairs of complete lines and an optional piece of a line
+    longer than `max_line_length`. Pieces of such a line are returned as soon
+    as they are read, and its last piece ends with a newline.
+    """
+
+    def __init__(self, max_line_length: int) -> None:
+        self._max_line_length = max_line_length
+        self._partial_line = ""
+        self._in_oversized_line = False
+
+    def split(
+            self,
+            text: str,
+            final: bool = False) -> List[Tuple[List[str], Optional[str]]]:
+        results: List[Tuple[List[str], Optional[str]]] = []
+
+        if self._in_oversized_line:
+            end = text.find("\n")
+            if end == -1:
+                if final:
+                    self._in_oversized_line = False
+                    return [([], text + "\n")]
+                return [([], text)]
+            results.append(([], text[:end + 1]))
+            self._in_oversized_line = False
+            text = text[end + 1:]
+
+        lines = (self._partial_line + text).split("\n")
+        self._partial_line = lines.pop()
+        if final and self._partial_line:
+            lines.append(self._partial_line)
+            self._partial_line = ""
+
+        max_line_length = self._max_line_length
+        if lines and max(map(len, lines)) > max_line_length:
+            start = 0
+            for index, line in enumerate(lines):
+                if len(line) > max_line_length:
+                    results.append((lines[start:index], line + "\n"))
+                    start = index + 1
+            lines = lines[start:]
+
+        if len(self._partial_line) > max_line_length:
+            results.append((lines, self._partial_line))
+            self._partial_line = ""
+            self._in_oversized_line = True
+        else:
+            results.append((lines, None))
+
+        return results
+
+
+def _iter_line_chunks(
+        stream,
+        timeout: Callable[[], Optional[float]],
+        max_line_length: int = _MAX_LINE_LENGTH,
+        tee: Optional[Callable[[bytes], None]] = None,
+) -> Iterator[Tuple[List[str], Optional[str]]]:
+    """Yields complete lines read from `stream`.
+
+    `stream` is read in large chunks as soon as data is available. Lines are
+    yielded as in `_LineSplitter.split()`. If `timeout()` seconds pass without
+    any new data, no lines are yielded, giving the caller a chance to flush its
+    output. If set, `tee` is called with every chunk that is read.
+    """
+    # Same newline handling as `universal_newlines=True`
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder("utf-8")(errors = "replace"),
+        translate = True,
+    )
+    splitter = _LineSplitter(max_line_length)
+    fd = stream.fileno()
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            if not selector.select(timeout()):
+                yield ([], None)
+                continue
+
+            chunk = os.read(fd, _READ_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            if tee:
+                tee(chunk)
+            yield from splitter.split(decoder.decode(chunk))
+
+    yield from splitter.split(decoder.decode(b"", final = True), final = True)
+
+
+def _max_line_length() -> int:
+    value = os.getenv("RULES_XCODEPROJ_MAX_LOG_LINE_LENGTH")
+    if not value:
+        return _MAX_LINE_LENGTH
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(
+            f"""\
+warning: Ignoring invalid RULES_XCODEPROJ_MAX_LOG_LINE_LENGTH value "{value}"\
+""",
+            file = sys.stderr,
+        )
+        return _MAX_LINE_LENGTH
+
+
+def _parse_options(argv: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    """Splits `argv` into this script's options and the Bazel command."""
+    options = {}
+    while argv:
+        name, separator, value = argv[0].partition("=")
+        if not separator or name not in _OPTIONS:
+            break
+        options[name] = value
+        argv = argv[1:]
+    return options, argv
+
+
+def _missing_target_ids(
+        requested_target_ids_path: str,
+        target_ids_list_path: str) -> Optional[List[str]]:
+    """Returns the requested target IDs that aren't in the target IDs list.
+
+    Returns `None` if the target IDs list wasn't created. The target IDs list
+    can be large, so it's streamed through a set of the requested target IDs,
+    which are all that's held in memory.
+    """
+    # Lines are compared with their newlines, to avoid stripping each line of
+    # the target IDs list
+    with open(requested_target_ids_path, encoding = "utf-8") as f:
+        requested_target_ids = f.readlines()
+    if requested_target_ids and not requested_target_ids[-1].endswith("\n"):
+        requested_target_ids[-1] += "\n"
+    missing = set(requested_target_ids)
+    missing.discard("\n")
+
+    try:
+        with open(target_ids_list_path, encoding = "utf-8") as f:
+            last_line = None
+            for lines in iter(lambda: f.readlines(_READ_CHUNK_SIZE), []):
+                missing.difference_update(lines)
+                last_line = lines[-1]
+    except FileNotFoundError:
+        return None
+    if last_line is None:
+        return None
+    if not last_line.endswith("\n"):
+        missing.discard(f"{last_line}\n")
+
+    return sorted(target_id[:-1] for target_id in missing)
+
+
+def _verify_target_ids(
+        requested_target_ids_path: str,
+        target_ids_list_path: str) -> bool:
+    """Reports whether Bazel knew about all of the requested target IDs."""
+    missing_target_ids = _missing_target_ids(
+        requested_target_ids_path,
+        target_ids_list_path,
+    )
+    if missing_target_ids is None:
+        print(
+            f"""\
+error: "{target_ids_list_path}" was not created. This can happen if you apply \
+build-affecting flags to "rules_xcodeproj_generator" config, or with the \
+"--@rules_xcodeproj//xcodeproj:extra_generator_flags" flag. Please ensure that \
+all build-affecting flags are moved to the "rules_xcodeproj" config or \
+"--@rules_xcodeproj//xcodeproj:extra_common_flags" flag. If you are still \
+getting this error after adjusting your setup and regenerating your project, \
+please file a bug report here: \
+https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md\
+""",
+            file = sys.stderr,
+        )
+        return False
+
+    if missing_target_ids:
+        missing_target_ids_list = "\n".join(missing_target_ids)
+        print(
+            f"""\
+error: There were some target IDs that weren't known to Bazel (e.g. \
+"{missing_target_ids_list}"). Please regenerate the project to fix this. If you \
+are still getting this error after regenerating your project, please file a \
+bug report here: \
+https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md\
+""",
+            file = sys.stderr,
+        )
+        return False
+
+    return True
+
+
+def _raw_log_max_total_size() -> int:
+    value = os.getenv("RULES_XCODEPROJ_RAW_BUILD_LOG_MAX_SIZE")
+    if not value:
+        return _RAW_LOG_MAX_TOTAL_SIZE
+    try:
+        return max(0, int(value))
+    except ValueError:
+        print(
+            f"""\
+warning: Ignoring invalid RULES_XCODEPROJ_RAW_BUILD_LOG_MAX_SIZE value "{value}"\
+""",
+            file = sys.stderr,
+        )
+        return _RAW_LOG_MAX_TOTAL_SIZE
+
+
+def _main(argv: List[str]) -> None:
+    options, command = _parse_options(argv)
 
     def _signal_handler(signum, frame):
         """Print signal information and ignore the signal."""
@@ -58,65 +912,272 @@ def _main(command: List[str]) -> None:
 
     should_strip_color = os.getenv("COLOR_DIAGNOSTICS", default="YES") != "YES"
 
+    # When enabled, only the first occurrence of each diagnostic is printed,
+    # and a summary of the suppressed duplicates is printed at the end
+    collapse_duplicates = (
+        os.getenv("RULES_XCODEPROJ_COLLAPSE_DUPLICATE_DIAGNOSTICS") == "YES"
+    )
+    diagnostic_counts: Dict[str, int] = {}
+
+    # When set, each diagnostic is also written as a JSON Lines record to this
+    # path, for tools that want to consume diagnostics without parsing the log
+    diagnostics_path = os.getenv("RULES_XCODEPROJ_DIAGNOSTICS_JSON_PATH")
+    diagnostics_file = (
+        _open_diagnostics_file(diagnostics_path) if diagnostics_path else None
+    )
+
     has_relative_diagnostic = False
 
-    def _replacement(match: re.Match) -> str:
-        message = f"""\
-{match.group("loc")}{match.group("sev")}{_uppercase_first_letter(match.group("msg"))}\
-"""
+    # When enabled, the timing of the build's phases is summarized at the end,
+    # and written as JSON next to the build products
+    timeline = (
+        _BuildTimeline()
+        if os.getenv("RULES_XCODEPROJ_BUILD_TIMELINE") == "YES" else None
+    )
 
-        if message.startswith(execution_root):
+    # Large modules tend to report many diagnostics for the same few files, so
+    # the resolved form of each path is remembered
+    @functools.lru_cache(maxsize = _PATH_CACHE_SIZE)
+    def _resolve_path(path: str) -> str:
+        if path.startswith(execution_root):
             # VFS overlays can make paths absolute, so make them relative again
-            message = message[(len(execution_root) + 1):]
+            path = path[(len(execution_root) + 1):]
 
-        if message.startswith("/"):
+        if path.startswith("/"):
             # If still an absolute path, don't add a prefix
-            return message
+            return path
 
-        if message.startswith("bazel-out/"):
+        if path.startswith("bazel-out/"):
             prefix = bazel_out_prefix
-        elif message.startswith("external/"):
+        elif path.startswith("external/"):
             prefix = external_prefix
         else:
             prefix = srcroot
 
-        return f"{prefix}/{message}"
+        return f"{prefix}/{path}"
 
-    process = subprocess.Popen(
-        command, bufsize=1, stderr=subprocess.PIPE, universal_newlines=True
-    )
+    def _replacement(match: re.Match) -> Tuple[str, str, str]:
+        """Returns the rewritten diagnostic, its resolved path, and message."""
+        path, location, severity, message = match.group(
+            "path",
+            "loc",
+            "sev",
+            "msg",
+        )
+        resolved_path = _resolve_path(path)
+        message = _uppercase_first_letter(message)
+        return (
+            f"{resolved_path}{location[len(path):]}{severity}{message}",
+            resolved_path,
+            message,
+        )
+
+    # When set, Bazel writes its Build Event Protocol stream to this path, and
+    # failed actions and targets are reported from it as soon as their events
+    # arrive. Lines reported this way aren't repeated when they show up in
+    # Bazel's output, and vice versa.
+    build_event_path = os.getenv("RULES_XCODEPROJ_BUILD_EVENT_JSON_FILE")
+    build_event_reader = None
+    console_reported: Dict[str, int] = {}
+    build_event_reported: Dict[str, int] = {}
+    has_build_event_error = False
+    if build_event_path:
+        try:
+            if not stat.S_ISFIFO(os.stat(build_event_path).st_mode):
+                # Don't read events from a previous build
+                os.remove(build_event_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(
+                f"""\
+warning: Failed to remove previous build events file "{build_event_path}", so \
+build events won't be reported: {e}""",
+                file = sys.stderr,
+            )
+            build_event_path = None
+    if build_event_path:
+        command = _add_build_event_json_file_flag(command, build_event_path)
+        build_event_reader = _BuildEventReader(build_event_path)
+
+    def _already_reported(line: str, from_build_event: bool) -> bool:
+        """Returns whether the other source already reported `line`."""
+        if from_build_event:
+            reported, other_reported = build_event_reported, console_reported
+        else:
+            reported, other_reported = console_reported, build_event_reported
+        count = other_reported.get(line, 0)
+        if count:
+            if count == 1:
+                del other_reported[line]
+            else:
+                other_reported[line] = count - 1
+            return True
+        reported[line] = reported.get(line, 0) + 1
+        if (not from_build_event and
+            len(console_reported) > _BUILD_EVENT_DEDUPLICATION_WINDOW):
+            # Forget the oldest line
+            del console_reported[next(iter(console_reported))]
+        return False
+
+    # When enabled, a compressed copy of Bazel's unprocessed output is kept in
+    # `$OBJROOT/rules_xcodeproj_logs`
+    raw_log_writer = None
+    if os.getenv("RULES_XCODEPROJ_RAW_BUILD_LOG") == "YES":
+        objroot = os.getenv("OBJROOT")
+        if objroot:
+            raw_log_writer = _RawLogWriter(
+                os.path.join(objroot, "rules_xcodeproj_logs"),
+                max_total_size = _raw_log_max_total_size(),
+            )
+        else:
+            print(
+                "warning: OBJROOT isn't set, so the raw build log won't be kept",
+                file = sys.stderr,
+            )
+
+    process = subprocess.Popen(command, stderr=subprocess.PIPE)
     assert process.stderr
 
-    def _process_log_line(line: str):
+    def _process_log_line(
+            line: str,
+            from_build_event: bool = False) -> Optional[str]:
         input_line = line.rstrip()
 
-        if should_strip_color:
+        if should_strip_color and "\x1b" in input_line:
             input_line = STRIP_COLOR_RE.sub("", input_line)
 
         if not input_line:
-            return
+            return None
+
+        # Most lines (e.g. "INFO:" and progress lines) can't be diagnostics,
+        # so reject them with cheap substring checks before using the regex
+        match = (
+            RELATIVE_DIAGNOSTICS_RE.match(input_line)
+            if "error:" in input_line or "warning:" in input_line
+            else None
+        )
+        if not match:
+            # Only report a failed action's output once, whether Bazel's
+            # output or a build event reports it first
+            if (build_event_reader and
+                _already_reported(input_line, from_build_event)):
+                return None
+            return input_line
+
+        output_line, resolved_path, message = _replacement(match)
+
+        if (build_event_reader and
+            _already_reported(output_line, from_build_event)):
+            return None
+
+        if diagnostics_file:
+            diagnostics_file.write(
+                _diagnostic_record(match, resolved_path, message),
+            )
 
-        output_line = RELATIVE_DIAGNOSTICS_RE.sub(_replacement, input_line)
         # Record if we have performed a relative diagnostic substitution.
         if output_line != input_line:
             nonlocal has_relative_diagnostic
             has_relative_diagnostic = True
 
-        print(output_line, flush=True)
+        if collapse_duplicates:
+            count = diagnostic_counts.get(output_line, 0)
+            diagnostic_counts[output_line] = count + 1
+            if count:
+                return None
+
+        return output_line
+
+    writer = _BatchedWriter(sys.stdout)
 
-    while process.poll() is None:
-        _process_log_line(process.stderr.readline())
+    def _process_build_events() -> None:
+        nonlocal has_build_event_error
+        for event in build_event_reader.read():
+            error_lines, output_lines = _build_event_lines(event)
+            for line in error_lines:
+                has_build_event_error = True
+                writer.write_line(line)
+            for line in output_lines:
+                output_line = _process_log_line(line, from_build_event = True)
+                if output_line is not None:
+                    writer.write_line(output_line)
 
-    for line in process.stderr:
-        _process_log_line(line)
+    def _timeout() -> Optional[float]:
+        timeout = writer.timeout()
+        if build_event_reader:
+            if timeout is None or timeout > _BUILD_EVENT_POLL_INTERVAL:
+                return _BUILD_EVENT_POLL_INTERVAL
+        return timeout
+
+    max_line_length = _max_line_length()
+    in_oversized_line = False
+    for lines, oversized_piece in _iter_line_chunks(
+        process.stderr,
+        _timeout,
+        max_line_length,
+        raw_log_writer.write if raw_log_writer else None,
+    ):
+        if build_event_reader:
+            _process_build_events()
+        for line in lines:
+            if timeline:
+                timeline.observe(line)
+            output_line = _process_log_line(line)
+            if output_line is not None:
+                writer.write_line(output_line)
+        if oversized_piece is not None:
+            if not in_oversized_line:
+                writer.write_line(
+                    f"""\
+note: Passing through the following line unprocessed, since it is longer than \
+{max_line_length} characters\
+""",
+                )
+            writer.write(oversized_piece)
+            in_oversized_line = not oversized_piece.endswith("\n")
+        writer.flush_if_due()
+
+    process.wait()
+    if timeline:
+        timeline.finish()
+    if raw_log_writer:
+        raw_log_writer.close()
+
+    if build_event_reader:
+        _process_build_events()
+        build_event_reader.close()
+
+    for line in _duplicate_diagnostics_summary(diagnostic_counts):
+        writer.write_line(line)
+    if timeline:
+        writer.write_line(timeline.summary(process.returncode))
+        built_products_dir = os.getenv("BUILT_PRODUCTS_DIR")
+        if built_products_dir:
+            timeline.write(
+                os.path.join(built_products_dir, "bazel_build_timeline.json"),
+                process.returncode,
+            )
+    writer.flush()
+    if diagnostics_file:
+        diagnostics_file.close()
 
     # If the Bazel invocation failed and there was no formatted error found,
     # print a nicer error message instead of a cryptic in Xcode:
     # 'Command PhaseScriptExecution failed with a nonzero exit code'
-    if process.returncode != 0 and not has_relative_diagnostic:
+    if (process.returncode != 0 and not has_relative_diagnostic and
+            not has_build_event_error):
         print("error: The bazel build failed, please check the report navigator, "
             "which may have more context about the failure.")
 
+    if (process.returncode == 0 and
+            "--requested_target_ids" in options and
+            not _verify_target_ids(
+                options["--requested_target_ids"],
+                options["--target_ids_list"],
+            )):
+        sys.exit(1)
+
     sys.exit(process.returncode)
 
 
@@ -0,0 +1,644 @@
+"""Tests for process_bazel_build_log."""
+
+import glob
+import gzip
+import io
+import json
+import os
+import tempfile
+import subprocess
+import sys
+import threading
+import unittest
+
+from xcodeproj.internal.bazel_integration_files import process_bazel_build_log
+
+_SCRIPT = process_bazel_build_log.__file__
+
+class process_bazel_build_log_test(unittest.TestCase):
+
+    def _run(
+            self,
+            shell_command,
+            args = None,
+            argv = None,
+            env = None,
+            stderr = False):
+        return subprocess.run(
+            [sys.executable, _SCRIPT] + (argv or []) +
+            ["/bin/sh", "-c", shell_command, "sh"] + (args or []),
+            env = dict(
+                os.environ,
+                SRCROOT = "/src",
+                PROJECT_DIR = "/exec",
+                BAZEL_OUT = "/bazel/execroot/_main/bazel-out",
+                BAZEL_EXTERNAL = "/bazel/external",
+                **(env or {}),
+            ),
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE if stderr else None,
+            universal_newlines = True,
+            check = False,
+        )
+
+    def test_iter_line_chunks_splits_across_reads(self):
+        read_fd, write_fd = os.pipe()
+
+        def _write():
+            for chunk in [b"one\ntw", b"o\r\nthr", b"ee\rfo\xc3", b"\xa9ur"]:
+                os.write(write_fd, chunk)
+            os.close(write_fd)
+
+        thread = threading.Thread(target = _write)
+        thread.start()
+        with os.fdopen(read_fd, "rb", buffering = 0) as stream:
+            lines = [
+                line
+                for chunk, _ in process_bazel_build_log._iter_line_chunks(
+                    stream,
+                    lambda: None,
+                )
+                for line in chunk
+            ]
+        thread.join()
+
+        self.assertEqual(lines, ["one", "two", "three", "foéur"])
+
+    def test_iter_line_chunks_yields_on_timeout(self):
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd, "rb", buffering = 0) as stream:
+            chunks = process_bazel_build_log._iter_line_chunks(
+                stream,
+                lambda: 0.01,
+            )
+            self.assertEqual(next(chunks), ([], None))
+            os.write(write_fd, b"line\n")
+            os.close(write_fd)
+            self.assertEqual(
+                [line for chunk, _ in chunks for line in chunk],
+                ["line"],
+            )
+
+    def test_line_splitter(self):
+        splitter = process_bazel_build_log._LineSplitter(max_line_length = 5)
+
+        self.assertEqual(
+            splitter.split("a\nbcdefgh\nij\nklm"),
+            [(["a"], "bcdefgh\n"), (["ij"], None)],
+        )
+        self.assertEqual(splitter.split("nop"), [([], "klmnop")])
+        self.assertEqual(splitter.split("qrs"), [([], "qrs")])
+        self.assertEqual(
+            splitter.split("t\nwx\ny"),
+            [([], "t\n"), (["wx"], None)],
+        )
+        self.assertEqual(splitter.split("z", final = True), [(["yz"], None)])
+
+        splitter.split("abcdefg")
+        self.assertEqual(splitter.split("", final = True), [([], "\n")])
+
+    def test_main_passes_through_oversized_lines(self):
+        long_line = "x: error: " + "y" * 200
+        result = self._run(
+            f"""\
+printf 'a.swift:1:2: error: before\\n%s\\na.swift:3:4: error: after\\n' \
+  {_shell_quote(long_line)} >&2
+""",
+            env = {"RULES_XCODEPROJ_MAX_LOG_LINE_LENGTH": "100"},
+        )
+
+        self.assertEqual(
+            result.stdout,
+            f"""\
+/src/a.swift:1:2: error: Before
+note: Passing through the following line unprocessed, since it is longer than \
+100 characters
+{long_line}
+/src/a.swift:3:4: error: After
+""",
+        )
+
+    def test_batched_writer(self):
+        stream = io.StringIO()
+        writer = process_bazel_build_log._BatchedWriter(
+            stream,
+            flush_size = 10,
+            flush_delay = 60,
+        )
+
+        writer.write_line("abc")
+        writer.flush_if_due()
+        self.assertEqual(stream.getvalue(), "")
+        self.assertGreater(writer.timeout(), 0)
+
+        writer.write_line("defghi")
+        self.assertEqual(stream.getvalue(), "abc\ndefghi\n")
+        self.assertIsNone(writer.timeout())
+
+        writer.write_line("j")
+        writer.flush()
+        self.assertEqual(stream.getvalue(), "abc\ndefghi\nj\n")
+
+    def test_main_processes_diagnostics(self):
+        result = self._run(
+            "printf 'INFO: Build\\n\\n' >&2; "
+            "printf 'a/b.swift:1:2: error: bad\\n' >&2; "
+            "printf 'bazel-out/c.swift:3:4: warning: odd\\n' >&2; "
+            "printf '/exec/d.m:5:6: error: see' >&2; "
+            "exit 3",
+        )
+
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(
+            result.stdout,
+            """\
+INFO: Build
+/src/a/b.swift:1:2: error: Bad
+/bazel/execroot/_main/bazel-out/c.swift:3:4: warning: Odd
+/src/d.m:5:6: error: See
+""",
+        )
+
+    def test_main_reports_unformatted_failure(self):
+        result = self._run("echo 'ERROR: oops' >&2; exit 1")
+
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(
+            result.stdout.splitlines(),
+            [
+                "ERROR: oops",
+                "error: The bazel build failed, please check the report "
+                "navigator, which may have more context about the failure.",
+            ],
+        )
+
+    def test_main_strips_color(self):
+        result = self._run(
+            "printf '\\033[31mERROR:\\033[0m oops\\n' >&2",
+            env = {"COLOR_DIAGNOSTICS": "NO"},
+        )
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, "ERROR: oops\n")
+
+    def test_main_matches_unfiltered_rewriting(self):
+        lines = [
+            "INFO: Analyzed 3 targets",
+            "[12 / 40] Compiling Swift module //Foo:Bar; 3s darwin-sandbox",
+            "a/b.swift:1:2: fatal error: missing module",
+            "a/b.swift:1: warning:\tnot a space before the message",
+            "a/b.swift:1:2: error:",
+            "a/b.swift:1:2: note: not rewritten",
+            "/exec/bazel-out/e.swift:4:5: error: in the execution root",
+            "/abs/f.swift:6:7: error: Already absolute",
+            "ERROR: /src/BUILD:1:1: Compiling failed: error: exit 1",
+            "error: no location",
+            "warning: something:1:2: error: odd",
+            "\x1b[31mg.swift:8:9: \x1b[1merror:\x1b[0m colored",
+        ]
+        script = "".join(
+            f"printf '%s\\n' {_shell_quote(line)} >&2; " for line in lines
+        )
+
+        for color in ["YES", "NO"]:
+            with self.subTest(color = color):
+                result = self._run(
+                    script,
+                    env = {"COLOR_DIAGNOSTICS": color},
+                )
+                self.assertEqual(
+                    result.stdout.splitlines(),
+                    [
+                        _unfiltered_rewrite(line, strip_color = color == "NO")
+                        for line in lines
+                    ],
+                )
+
+    def test_main_collapses_duplicate_diagnostics(self):
+        script = (
+            "printf 'a.swift:1:2: warning: unused\\n' >&2; " * 3 +
+            "printf 'b.swift:3:4: error: bad\\n' >&2; " +
+            "printf 'INFO: Build\\n' >&2; " * 2 +
+            "printf '/exec/b.swift:3:4: error: bad\\n' >&2; "
+        )
+
+        with self.subTest("disabled"):
+            result = self._run(script)
+            self.assertEqual(len(result.stdout.splitlines()), 7)
+
+        with self.subTest("enabled"):
+            result = self._run(
+                script,
+                env = {"RULES_XCODEPROJ_COLLAPSE_DUPLICATE_DIAGNOSTICS": "YES"},
+            )
+            self.assertEqual(
+                result.stdout,
+                """\
+/src/a.swift:1:2: warning: Unused
+/src/b.swift:3:4: error: Bad
+INFO: Build
+INFO: Build
+note: Suppressed 3 duplicate diagnostics:
+note:   (3x) /src/a.swift:1:2: warning: Unused
+note:   (2x) /src/b.swift:3:4: error: Bad
+""",
+            )
+
+    def test_main_writes_diagnostics_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            diagnostics_path = os.path.join(tmp, "logs/diagnostics.jsonl")
+            result = self._run(
+                "printf 'INFO: Build\\n' >&2; "
+                "printf 'a.swift:1:2: warning: unused\\n' >&2; "
+                "printf 'a.swift:1:2: warning: unused\\n' >&2; "
+                "printf '/exec/bazel-out/b.h:3: fatal error: missing\\n' >&2",
+                env = {
+                    "RULES_XCODEPROJ_COLLAPSE_DUPLICATE_DIAGNOSTICS": "YES",
+                    "RULES_XCODEPROJ_DIAGNOSTICS_JSON_PATH": diagnostics_path,
+                },
+            )
+            with open(diagnostics_path, encoding = "utf-8") as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(
+            records,
+            [
+                {
+                    "file": "a.swift",
+                    "line": 1,
+                    "column": 2,
+                    "severity": "warning",
+                    "message": "Unused",
+                    "path": "/src/a.swift",
+                },
+                {
+                    "file": "a.swift",
+                    "line": 1,
+                    "column": 2,
+                    "severity": "warning",
+                    "message": "Unused",
+                    "path": "/src/a.swift",
+                },
+                {
+                    "file": "/exec/bazel-out/b.h",
+                    "line": 3,
+                    "column": None,
+                    "severity": "error",
+                    "message": "Missing",
+                    "path": "/bazel/execroot/_main/bazel-out/b.h",
+                },
+            ],
+        )
+
+    def test_main_reports_build_events(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            stderr_path = os.path.join(tmp, "stderr-4")
+            with open(stderr_path, "w", encoding = "utf-8") as f:
+                f.write(_ACTION_STDERR)
+            events_path = os.path.join(tmp, "recorded.json")
+            with open(events_path, "w", encoding = "utf-8") as f:
+                f.write(
+                    _RECORDED_BUILD_EVENTS.replace(
+                        "STDERR_URI",
+                        f"file://{stderr_path}",
+                    ),
+                )
+
+            result = self._run(
+                f"""\
+test "$1" = build || exit 2
+cp {events_path} "${{2#--build_event_json_file=}}"
+sleep 0.5
+printf '%s\\n' \
+  "ERROR: /src/BUILD:3:14: Compiling Swift module //:Lib failed: (Exit 1)" >&2
+printf '%s' {_shell_quote(_ACTION_STDERR)} >&2
+printf 'ERROR: Build did NOT complete successfully\\n' >&2
+exit 1
+""",
+                args = ["build", "//:App"],
+                env = {
+                    "RULES_XCODEPROJ_BUILD_EVENT_JSON_FILE": os.path.join(
+                        tmp,
+                        "build_events.json",
+                    ),
+                },
+            )
+
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(
+            result.stdout,
+            """\
+error: SwiftCompile of //:Lib failed: Compiling Swift module //:Lib failed: \
+(Exit 1)
+/src/Foo.swift:1:2: error: Cannot find 'x' in scope
+  x
+  ^
+error: //:App failed to build: Build did NOT complete successfully
+ERROR: /src/BUILD:3:14: Compiling Swift module //:Lib failed: (Exit 1)
+ERROR: Build did NOT complete successfully
+""",
+        )
+
+    def test_main_disables_build_events_if_previous_file_is_kept(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            # A directory can't be removed with `os.remove`
+            result = self._run(
+                'test "$2" = //:App && echo ok >&2',
+                args = ["build", "//:App"],
+                env = {"RULES_XCODEPROJ_BUILD_EVENT_JSON_FILE": tmp},
+                stderr = True,
+            )
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, "ok\n")
+        self.assertIn(
+            "warning: Failed to remove previous build events file",
+            result.stderr,
+        )
+
+    def test_build_event_reader(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "events.json")
+            reader = process_bazel_build_log._BuildEventReader(path)
+            self.assertEqual(reader.read(), [])
+
+            with open(path, "w", encoding = "utf-8") as f:
+                f.write('{"a": 1}\n{"b":')
+                f.flush()
+                self.assertEqual(reader.read(), [{"a": 1}])
+                self.assertEqual(reader.read(), [])
+
+                f.write(' 2}\nnot json\n\n{"c": 3}\n')
+                f.flush()
+                self.assertEqual(reader.read(), [{"b": 2}, {"c": 3}])
+            reader.close()
+
+    def test_add_build_event_json_file_flag(self):
+        self.assertEqual(
+            process_bazel_build_log._add_build_event_json_file_flag(
+                ["bazel", "--output_base=/build", "build", "--config=x", "//:a"],
+                "/tmp/bep.json",
+            ),
+            [
+                "bazel",
+                "--output_base=/build",
+                "build",
+                "--build_event_json_file=/tmp/bep.json",
+                "--config=x",
+                "//:a",
+            ],
+        )
+
+    def test_main_writes_build_timeline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            result = self._run(
+                """\
+printf 'Loading: 0 packages loaded\\n' >&2
+printf 'Analyzing: 3 targets (45 packages loaded)\\n' >&2
+printf '\\033[32mINFO: \\033[0mAnalyzed 3 targets (45 packages loaded).\\n' >&2
+sleep 0.2
+printf '\\033[32mINFO: \\033[0mFound 3 targets...\\n' >&2
+printf '[1 / 1,204] Compiling Swift module //:Lib\\n' >&2
+sleep 0.3
+printf '[1,203 / 1,204] Linking App\\n' >&2
+printf 'INFO: Elapsed time: 0.62s, Critical Path: 0.41s\\n' >&2
+printf 'INFO: 37 processes: 12 internal, 25 darwin-sandbox.\\n' >&2
+printf 'INFO: Build completed successfully, 1,204 total actions\\n' >&2
+""",
+                env = {
+                    "BUILT_PRODUCTS_DIR": os.path.join(tmp, "Debug"),
+                    "RULES_XCODEPROJ_BUILD_TIMELINE": "YES",
+                },
+            )
+            with open(
+                os.path.join(tmp, "Debug/bazel_build_timeline.json"),
+                encoding = "utf-8",
+            ) as f:
+                timeline = json.load(f)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertRegex(
+            result.stdout.splitlines()[-1],
+            r"^Bazel build timeline: loading \d+\.\d\ds, analysis \d+\.\d\ds, "
+            r"execution \d+\.\d\ds, completion \d+\.\d\ds \(total \d+\.\d\ds, "
+            r"critical path 0\.41s, 1204 actions, 37 processes\)$",
+        )
+
+        self.assertEqual(
+            [phase["name"] for phase in timeline["phases"]],
+            ["loading", "analysis", "execution", "completion"],
+        )
+        phase_durations = {
+            phase["name"]: phase["duration"] for phase in timeline["phases"]
+        }
+        self.assertGreaterEqual(phase_durations["analysis"], 0.15)
+        self.assertGreaterEqual(phase_durations["execution"], 0.25)
+        self.assertGreaterEqual(
+            timeline["duration"],
+            sum(phase_durations.values()) - 0.01,
+        )
+        self.assertEqual(timeline["exit_code"], 0)
+        self.assertEqual(timeline["elapsed_time"], 0.62)
+        self.assertEqual(timeline["critical_path"], 0.41)
+        self.assertEqual(timeline["actions"], {"completed": 1203, "total": 1204})
+        self.assertEqual(
+            timeline["processes"],
+            {"total": 37, "internal": 12, "darwin-sandbox": 25},
+        )
+
+    def test_main_keeps_raw_build_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            result = self._run(
+                "printf '\\033[31mERROR:\\033[0m a.swift:1:2: error: bad\\n' >&2",
+                env = {"OBJROOT": tmp, "RULES_XCODEPROJ_RAW_BUILD_LOG": "YES"},
+            )
+            logs = glob.glob(
+                os.path.join(tmp, "rules_xcodeproj_logs/bazel_build_*.1.log.gz"),
+            )
+            self.assertEqual(len(logs), 1)
+            with gzip.open(logs[0]) as f:
+                raw_log = f.read()
+
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(raw_log, b"\033[31mERROR:\033[0m a.swift:1:2: error: bad\n")
+
+    def test_raw_log_writer_rotates_and_prunes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            old_log = os.path.join(tmp, "bazel_build_20240101-000000_1.1.log.gz")
+            with open(old_log, "wb") as f:
+                f.write(b"x" * 600000)
+            os.utime(old_log, (0, 0))
+            unrelated = os.path.join(tmp, "calculate_output_groups.trace.json")
+            with open(unrelated, "wb") as f:
+                f.write(b"x" * 10000)
+
+            writer = process_bazel_build_log._RawLogWriter(
+                tmp,
+                max_file_size = 1000,
+                max_total_size = 1000000,
+            )
+            chunks = [os.urandom(100000) for _ in range(5)]
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.close()
+
+            self.assertFalse(os.path.exists(old_log))
+            self.assertTrue(os.path.exists(unrelated))
+            parts = sorted(
+                glob.glob(os.path.join(tmp, "bazel_build_*.log.gz")),
+                key = lambda path: int(path.split(".")[-3]),
+            )
+            self.assertEqual(len(parts), 5)
+            data = b""
+            for part in parts:
+                with gzip.open(part) as f:
+                    data += f.read()
+            self.assertEqual(data, b"".join(chunks))
+
+    def test_raw_log_writer_drops_output_past_pending_limit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = process_bazel_build_log._RawLogWriter(
+                tmp,
+                max_pending_size = 0,
+            )
+            writer.write(b"dropped")
+            writer._max_pending_size = 1024
+            writer.write(b"kept\n")
+            writer.close()
+
+            with gzip.open(glob.glob(os.path.join(tmp, "*.log.gz"))[0]) as f:
+                self.assertEqual(
+                    f.read(),
+                    b"""
+[rules_xcodeproj: 7 bytes of output were dropped, since they couldn't be \
+compressed fast enough]
+kept
+""",
+                )
+
+    def test_main_verifies_target_ids(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            requested_target_ids = os.path.join(tmp, "requested_target_ids")
+            with open(requested_target_ids, "w", encoding = "utf-8") as f:
+                f.write("//:a macos-arm64\n//:c macos-arm64\n//:b macos-arm64\n")
+            target_ids_list = os.path.join(tmp, "target_ids_list")
+            argv = [
+                f"--requested_target_ids={requested_target_ids}",
+                f"--target_ids_list={target_ids_list}",
+            ]
+
+            with self.subTest("not created"):
+                result = self._run("true", argv = argv, stderr = True)
+                self.assertEqual(result.returncode, 1)
+                self.assertIn(
+                    f'error: "{target_ids_list}" was not created.',
+                    result.stderr,
+                )
+
+            with open(target_ids_list, "w", encoding = "utf-8") as f:
+                f.write("//:b macos-arm64\n//:d macos-arm64")
+
+            with self.subTest("missing"):
+                result = self._run("true", argv = argv, stderr = True)
+                self.assertEqual(result.returncode, 1)
+                self.assertIn(
+                    """\
+error: There were some target IDs that weren't known to Bazel (e.g. \
+"//:a macos-arm64
+//:c macos-arm64"). Please regenerate the project to fix this.""",
+                    result.stderr,
+                )
+
+            with self.subTest("build failed"):
+                result = self._run("exit 3", argv = argv, stderr = True)
+                self.assertEqual(result.returncode, 3)
+                self.assertNotIn("target IDs", result.stderr)
+
+            with open(target_ids_list, "a", encoding = "utf-8") as f:
+                f.write("\n//:a macos-arm64\n//:c macos-arm64")
+
+            with self.subTest("all built"):
+                result = self._run("true", argv = argv, stderr = True)
+                self.assertEqual(result.returncode, 0)
+                self.assertEqual(result.stderr, "")
+
+    def test_parse_options(self):
+        self.assertEqual(
+            process_bazel_build_log._parse_options(
+                [
+                    "--target_ids_list=a",
+                    "--requested_target_ids=b",
+                    "bazel",
+                    "--target_ids_list=c",
+                ],
+            ),
+            (
+                {"--requested_target_ids": "b", "--target_ids_list": "a"},
+                ["bazel", "--target_ids_list=c"],
+            ),
+        )
+
+    def test_duplicate_diagnostics_summary(self):
+        self.assertEqual(
+            process_bazel_build_log._duplicate_diagnostics_summary({"a": 1}),
+            [],
+        )
+        self.assertEqual(
+            process_bazel_build_log._duplicate_diagnostics_summary(
+                {"a": 2, "b": 1, "c": 4, "d": 2},
+                limit = 2,
+            ),
+            [
+                "note: Suppressed 5 duplicate diagnostics:",
+                "note:   (4x) c",
+                "note:   (2x) a",
+                "note:   ... and 1 more repeated diagnostics",
+            ],
+        )
+
+_ACTION_STDERR = """\
+Foo.swift:1:2: error: cannot find 'x' in scope
+  x
+  ^
+"""
+
+# Recorded with `--build_event_json_file`, trimmed to the relevant events
+_RECORDED_BUILD_EVENTS = """\
+{"id":{"started":{}},"children":[{"progress":{}},{"pattern":{"pattern":["//:App"]}}],"started":{"uuid":"0b6c2f4e-5d1a-4c36-9a57-1f0c8f1e2d3a","startTimeMillis":"1700000000000","buildToolVersion":"7.4.1","command":"build"}}
+{"id":{"progress":{}},"children":[{"progress":{"opaqueCount":1}}],"progress":{"stderr":"Loading: 0 packages loaded\\n"}}
+{"id":{"actionCompleted":{"primaryOutput":"bazel-out/darwin_arm64-dbg/bin/Lib.swiftmodule","label":"//:Lib","configuration":{"id":"b1a6d2"}}},"action":{"type":"SwiftCompile","exitCode":1,"stderr":{"name":"stderr","uri":"STDERR_URI"},"label":"//:Lib","configuration":{"id":"b1a6d2"},"failureDetail":{"message":"Compiling Swift module //:Lib failed: (Exit 1)","spawn":{"code":"NON_ZERO_EXIT","spawnExitCode":1}}}}
+{"id":{"targetCompleted":{"label":"//:App","configuration":{"id":"b1a6d2"}}},"aborted":{"reason":"INCOMPLETE","description":"Build did NOT complete successfully"}}
+{"id":{"targetCompleted":{"label":"//:Other","configuration":{"id":"b1a6d2"}}},"completed":{"success":true}}
+{"id":{"buildFinished":{}},"finished":{"overallSuccess":false,"exitCode":{"name":"BUILD_FAILURE","code":1},"finishTimeMillis":"1700000004000"}}
+"""
+
+def _shell_quote(s):
+    return "'" + s.replace("'", "'\\''") + "'"
+
+def _unfiltered_rewrite(line, strip_color):
+    """The original per-line rewriting, without any fast paths."""
+    if strip_color:
+        line = process_bazel_build_log.STRIP_COLOR_RE.sub("", line)
+
+    def _replacement(match):
+        message = (
+            match.group("loc") +
+            match.group("sev") +
+            process_bazel_build_log._uppercase_first_letter(match.group("msg"))
+        )
+        if message.startswith("/exec"):
+            message = message[len("/exec/"):]
+        if message.startswith("/"):
+            return message
+        if message.startswith("bazel-out/"):
+            return f"/bazel/execroot/_main/{message}"
+        return f"/src/{message}"
+
+    return process_bazel_build_log.RELATIVE_DIAGNOSTICS_RE.sub(
+        _replacement,
+        line,
+    )
+
+if __name__ == '__main__':
+    unittest.main()
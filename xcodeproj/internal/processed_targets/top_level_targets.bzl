@@ -116,8 +116,10 @@ def _create_link_params(
         label,
         linker_inputs,
         merged_product_files,
+        params_cache_dir,
         product,
-        tool):
+        tool,
+        use_workers):
     if not linker_inputs:
         return None
 
@@ -191,16 +193,37 @@ def _create_link_params(
     args.add(TRUE_ARG if is_framework else FALSE_ARG)
     args.add_all(link_sub_params)
 
+    execution_requirements = {}
+    if use_workers:
+        # A flagfile is required for persistent workers
+        args.use_param_file("@%s", use_always = True)
+        args.set_param_file_format("multiline")
+
+        # Avoid the interpreter startup cost for each target
+        execution_requirements["requires-worker-protocol"] = "json"
+        execution_requirements["supports-workers"] = "1"
+    if params_cache_dir:
+        env = {"RULES_XCODEPROJ_PARAMS_CACHE_DIR": params_cache_dir}
+
+        # The cache is read and written outside of the sandbox, and only
+        # exists on this machine
+        execution_requirements["no-remote"] = "1"
+        execution_requirements["no-sandbox"] = "1"
+    else:
+        env = None
+
     actions.run(
         executable = tool,
         arguments = [args],
         mnemonic = "ProcessLinkParams",
         progress_message = "Generating %{output}",
+        env = env,
         inputs = (
             [generated_product_paths_file] +
             list(top_level_values.link_args_inputs)
         ) + link_sub_params,
         outputs = [link_params],
+        execution_requirements = execution_requirements,
     )
 
     return link_params
@@ -515,10 +538,14 @@ def _process_focused_top_level_target(
         bin_dir_path = bin_dir_path,
         label = label,
         tool = ctx.executable._link_params_processor,
+        use_workers = (
+            ctx.attr._use_params_processor_workers[BuildSettingInfo].value
+        ),
         linker_inputs = linker_inputs,
         merged_product_files = (
             mergeable_info.product_files if mergeable_info else None
         ),
+        params_cache_dir = ctx.attr._params_cache_dir[BuildSettingInfo].value,
         product = product,
     )
 
@@ -157,9 +157,22 @@ fi
 
 # Build
 
+# After a successful build, `process_bazel_build_log.py` verifies that we
+# actually built what we requested
+verify_target_ids_flags=()
+if [[ -n "${target_ids:-}" ]]; then
+  readonly requested_target_ids="$OBJROOT/rules_xcodeproj_requested_target_ids"
+  printf '%s\n' "${target_ids[@]}" > "$requested_target_ids"
+  verify_target_ids_flags=(
+    --requested_target_ids="$requested_target_ids"
+    --target_ids_list="%target_ids_list%"
+  )
+fi
+
 echo "Starting Bazel build"
 
 "$BAZEL_INTEGRATION_DIR/process_bazel_build_log.py" \
+  ${verify_target_ids_flags[@]+"${verify_target_ids_flags[@]}"} \
   "${bazel_cmd[@]}" \
   build \
   "${base_pre_config_flags[@]}" \
@@ -171,39 +184,3 @@ echo "Starting Bazel build"
   "%generator_label%" \
   ${labels:+"--build_metadata=PATTERN=${labels[*]}"} \
   2>&1
-
-# Verify that we actually built what we requested
-
-if [[ -n "${target_ids:-}" ]]; then
-  if [[ ! -s "%target_ids_list%" ]]; then
-      echo "error: \"%target_ids_list%\" was not created. This can happen if" \
-"you apply build-affecting flags to \"rules_xcodeproj_generator\" config, or" \
-"with the \"--@rules_xcodeproj//xcodeproj:extra_generator_flags\" flag." \
-"Please ensure that all build-affecting flags are moved to the" \
-"\"rules_xcodeproj\" config or" \
-"\"--@rules_xcodeproj//xcodeproj:extra_common_flags\" flag. If you are still" \
-"getting this error after adjusting your setup and regenerating your project," \
-"please file a bug report here:" \
-"https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md" \
-        >&2
-      exit 1
-  fi
-
-  # We need to sort the inputs for `comm` to work on macOS 15.4+
-  diff_output=$(
-    comm -23 \
-      <(printf '%s\n' "${target_ids[@]}" | sort) \
-      <(sort "%target_ids_list%")
-  )
-
-  if [ -n "$diff_output" ]; then
-    missing_target_ids=("${diff_output[@]}")
-    echo "error: There were some target IDs that weren't known to Bazel" \
-"(e.g. \"${missing_target_ids[0]}\"). Please regenerate the project to fix" \
-"this. If you are still getting this error after regenerating your project," \
-"please file a bug report here:" \
-"https://github.com/MobileNativeFoundation/rules_xcodeproj/issues/new?template=bug.md" \
-      >&2
-    exit 1
-  fi
-fi
@@ -88,6 +88,10 @@ def _xcodeproj_aspect_attrs(
             ),
             executable = True,
         ),
+        "_params_cache_dir": attr.label(
+            default = Label("//xcodeproj:params_cache_dir"),
+            providers = [BuildSettingInfo],
+        ),
         "_separate_index_build_output_base": attr.label(
             default = Label("//xcodeproj:separate_index_build_output_base"),
             providers = [BuildSettingInfo],
@@ -100,6 +104,10 @@ def _xcodeproj_aspect_attrs(
             executable = True,
         ),
         "_unfocused_labels": attr.string_list(default = unfocused_labels),
+        "_use_params_processor_workers": attr.label(
+            default = Label("//xcodeproj:use_params_processor_workers"),
+            providers = [BuildSettingInfo],
+        ),
         "_xcode_config": attr.label(
             default = configuration_field(
                 name = "xcode_config_label",